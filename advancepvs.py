@@ -1,5 +1,5 @@
 import argparse, chess, re
-
+from matecheck import Suite
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -9,7 +9,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "--epdFile",
         default="matetrackpv.epd",
-        help="file containing the positions, their mate scores and their PVs",
+        help="file containing the positions, their mate scores and their PVs, or a compiled suite",
     )
     parser.add_argument(
         "--outFile",
@@ -38,15 +38,21 @@ if __name__ == "__main__":
     p = re.compile(r"([0-9a-zA-Z/\- ]*) bm #([0-9\-]*);")
     fens = []
 
-    with open(args.epdFile) as f:
-        for line in f:
-            m = p.match(line)
-            assert m, f"error for line '{line[:-1]}' in file {args.epdFile}"
-            fen, bm = m.group(1), int(m.group(2))
-            _, _, pv = line.partition("; PV: ")
-            pv, _, _ = pv[:-1].partition(";")  # remove '\n'
-            pv = pv.split()
-            fens.append((fen, bm, pv, line))
+    if Suite.is_suite(args.epdFile):
+        for fen, bm, pv in Suite(args.epdFile):
+            assert bm is not None, f"no bm for FEN {fen} in file {args.epdFile}"
+            line = f"{fen} bm #{bm};" + (f" PV: {' '.join(pv)};" if pv else "")
+            fens.append((fen, bm, pv, line + "\n"))
+    else:
+        with open(args.epdFile) as f:
+            for line in f:
+                m = p.match(line)
+                assert m, f"error for line '{line[:-1]}' in file {args.epdFile}"
+                fen, bm = m.group(1), int(m.group(2))
+                _, _, pv = line.partition("; PV: ")
+                pv, _, _ = pv[:-1].partition(";")  # remove '\n'
+                pv = pv.split()
+                fens.append((fen, bm, pv, line))
 
     print(f"{len(fens)} FENs loaded ...")
 
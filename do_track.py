@@ -0,0 +1,360 @@
+import argparse, os, re, shlex, shutil, subprocess, sys, threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+HEADER = "Commit Date,Commit SHA,Positions,Mates,Best mates,Better mates,Wrong mates,Bad PVs,Release tag"
+SF3 = "aa2368a6878a867fe63247ee2adf2fde3dfe22be"
+EPDFILES = {"matetrack": "matetrack.epd", "classic": "classic280.epd"}
+
+
+class CoreBudget:
+    """A global number of cores, shared by the builds and the matecheck runs."""
+
+    def __init__(self, cores):
+        self.total = self.free = cores
+        self.cond = threading.Condition()
+
+    def acquire(self, cores):
+        """Wait until cores of them are free, and take them."""
+        cores = min(cores, self.total)
+        with self.cond:
+            self.cond.wait_for(lambda: self.free >= cores)
+            self.free -= cores
+            return cores
+
+    def release(self, cores):
+        with self.cond:
+            self.free += cores
+            self.cond.notify_all()
+
+
+class Tracker:
+    def __init__(self, args):
+        self.args = args
+        self.git = shlex.split(args.git)
+        self.make = shlex.split(args.make)
+        self.src = os.path.join(args.sfRepo, "src")
+        self.budget = CoreBudget(args.cores)
+        # a fixed share for each matecheck run, so that it neither starts with
+        # a single core nor takes the cores of the other jobs' builds
+        self.checkCores = max(1, args.cores // args.jobs)
+        self.lock = threading.Lock()  # serializes the git commands in sfRepo
+        repo = args.firstRev == SF3 and args.lastRev == "HEAD"
+        repo = repo and args.nodes == 1000000
+        self.repo = repo  # True if run with the repo's values
+        if repo:
+            self.suffix = str(args.nodes)
+        else:
+            self.suffix = f"_{args.firstRev}_{args.lastRev}_{args.nodes}"
+        with open(args.exclude) as f:
+            # the SHAs in the non-comment sections of the exclude file
+            self.exclude = "".join(line.partition("#")[0] for line in f)
+
+    def run(self, cmd, cwd=None, log=None, env=None, check=True):
+        if log is None:
+            return subprocess.run(
+                cmd, cwd=cwd, env=env, check=check, capture_output=True, text=True
+            ).stdout
+        with open(log, "w") as f:
+            return subprocess.run(
+                cmd, cwd=cwd, env=env, check=check, stdout=f, stderr=subprocess.STDOUT
+            )
+
+    def update(self):
+        """Clone or update Stockfish, and return the revisions and tags."""
+        args = self.args
+        if not os.path.exists(args.sfRepo):
+            self.run(self.git + ["clone", args.sfUrl, args.sfRepo], log=os.devnull)
+        if args.nnueFile and not os.path.isfile(args.nnueFile):
+            urllib.request.urlretrieve(
+                f"https://tests.stockfishchess.org/api/nn/{args.nnueFile}",
+                args.nnueFile,
+            )
+        src = self.src
+        self.run(
+            self.git + ["checkout", "master"], src, os.path.join(src, "checkout.log")
+        )
+        for cmd, msg in [("fetch", "Failed fetch!"), ("pull", "Failed pull")]:
+            log = os.path.join(src, f"{cmd}.log")
+            extra = ["origin"] if cmd == "fetch" else []
+            if self.run(self.git + [cmd] + extra, src, log, check=False).returncode:
+                print(msg)
+                with open(log) as f:
+                    print(f.read(), end="")
+        revs = self.run(
+            self.git + ["rev-list", "--reverse", f"{args.firstRev}^..{args.lastRev}"],
+            src,
+        ).split()
+        try:
+            output = self.run(self.git + ["ls-remote", "--quiet", "--tags"], src)
+            tags = [l for l in output.splitlines() if re.search(r"sf_[0-9]+", l)]
+        except subprocess.CalledProcessError:
+            print("Failed to ls-remote tags")
+            tags = []
+        return revs, tags
+
+    def binary(self, rev, arch):
+        return os.path.join(self.args.binDir, f"stockfish-{rev}-{arch}")
+
+    def build(self, rev):
+        """Build rev in its own worktree, unless it is in the binary cache."""
+        args = self.args
+        with self.lock:
+            for arch in ["x86-64-avx2", "x86-64-modern"]:
+                if os.path.isfile(self.binary(rev, arch)):
+                    return self.binary(rev, arch)
+            tree = os.path.abspath(os.path.join(args.buildDir, rev))
+            if os.path.exists(tree):
+                shutil.rmtree(tree)
+                self.run(self.git + ["worktree", "prune"], self.src)
+            self.run(
+                self.git + ["worktree", "add", "--detach", tree, rev],
+                self.src,
+                os.path.join(self.src, "checkout2.log"),
+            )
+        try:
+            src = os.path.join(tree, "src")
+            arch = "x86-64-avx2"
+            # for very old revisions, we need to fall back to x86-64-modern
+            with open(os.path.join(src, "Makefile")) as f:
+                if arch not in f.read():
+                    arch = "x86-64-modern"
+            print(f"compiling revision {rev}", flush=True)
+            cores = self.budget.acquire(args.buildCores)
+            try:
+                self.run(
+                    self.make + [f"-j{cores}", f"ARCH={arch}", "profile-build"],
+                    src,
+                    os.path.join(src, "make.log"),
+                    dict(os.environ, CXXFLAGS="-march=native"),
+                )
+            finally:
+                self.budget.release(cores)
+            binary = self.binary(rev, arch)
+            os.makedirs(args.binDir, exist_ok=True)
+            shutil.move(os.path.join(src, "stockfish"), binary + ".tmp")
+            os.replace(binary + ".tmp", binary)
+        finally:
+            with self.lock:
+                self.run(
+                    self.git + ["worktree", "remove", "--force", tree],
+                    self.src,
+                    check=False,
+                )
+        return binary
+
+    def matecheck(self, rev, prefix, binary):
+        """Return the results for rev on the suite prefix as a list of fields."""
+        args = self.args
+        epdfile = EPDFILES[prefix]
+        print(f"running matecheck on {epdfile} for {rev}", flush=True)
+        cores = self.budget.acquire(self.checkCores)
+        try:
+            cmd = [sys.executable, "matecheck.py", "--engine", binary]
+            cmd += ["--epdFile", epdfile, "--nodes", str(args.nodes)]
+            cmd += ["--concurrency", str(cores)]
+            if shutil.which("nice"):
+                cmd = ["nice"] + cmd
+            # the progress bar and warnings go to stderr, keep them out of out*
+            out = subprocess.run(
+                cmd, check=True, stdout=subprocess.PIPE, text=True
+            ).stdout
+        finally:
+            self.budget.release(cores)
+        # save wrong/better mates and wrong or incomplete PVs for possible debugging
+        if "issues" in out:
+            with open(f"out{prefix}{self.suffix}.{rev}", "w") as f:
+                f.write(out)
+        fields = []
+        for key in [
+            "Total FENs:",
+            "Found mates:",
+            "Best mates:",
+            "Better mates:",
+            "Wrong mates:",
+            "Bad PVs:",
+        ]:
+            lines = [l for l in out.splitlines() if l.startswith(key)]
+            fields.append(lines[0].split()[2] if lines else "")
+        return fields
+
+    def track(self, rev, tags, prefixes):
+        """Return the CSV lines of rev for the suites in prefixes."""
+        with self.lock:
+            epoch = self.run(
+                self.git + ["show", "-s", "--format=%cI", rev], self.src
+            ).strip()
+        tag = next(
+            (l.rpartition("/")[2].replace("sf_5^{}", "sf_5") for l in tags if rev in l),
+            "",
+        )
+        if rev in self.exclude:
+            print(f"skipping non-viable revision {rev}")
+            fields = {prefix: [""] * 6 for prefix in prefixes}
+        else:
+            binary = self.build(rev)
+            fields = {
+                prefix: self.matecheck(rev, prefix, binary) for prefix in prefixes
+            }
+        return {p: ",".join([epoch, rev] + fields[p] + [tag]) for p in prefixes}
+
+
+def append_lines(csv, lines):
+    """Atomically replace csv with a copy that has lines appended."""
+    with open(csv) as f:
+        content = f.read()
+    tmp = csv + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(content + "".join(line + "\n" for line in lines))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, csv)
+
+
+if __name__ == "__main__":
+    cores = os.cpu_count()
+    cores = 3 * cores // 4 if cores > 1 else 1  # be nice to other processes
+    parser = argparse.ArgumentParser(
+        description="Build the Stockfish revisions from firstRev to lastRev, and append the results of matecheck.py for them to e.g. matetrack1000000.csv.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--firstRev", default=SF3, help="first revision to track")
+    parser.add_argument("--lastRev", default="HEAD", help="last revision to track")
+    parser.add_argument(
+        "--nodes", type=int, default=1000000, help="nodes limit per position"
+    )
+    parser.add_argument(
+        "--suites",
+        nargs="+",
+        choices=list(EPDFILES),
+        default=list(EPDFILES),
+        help="test suites to track",
+    )
+    parser.add_argument(
+        "--exclude",
+        default="exclude_commits.sha",
+        help="file with the SHAs of revisions that do not compile",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=2,
+        help="number of revisions that are built and checked concurrently",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=cores,
+        help="total number of cores shared by all builds and matecheck runs, of which each matecheck run uses CORES // JOBS, default: 3/4 of cpu_count()",
+    )
+    parser.add_argument(
+        "--buildCores",
+        type=int,
+        default=max(1, cores // 4),
+        help="maximal number of cores for a single build",
+    )
+    parser.add_argument(
+        "--binDir",
+        default="binaries",
+        help="cache for the compiled binaries, keyed by SHA and arch",
+    )
+    parser.add_argument(
+        "--buildDir",
+        default="builds",
+        help="directory for the temporary git worktrees of the builds",
+    )
+    parser.add_argument(
+        "--sfRepo", default="Stockfish", help="local clone of the Stockfish repo"
+    )
+    parser.add_argument(
+        "--sfUrl",
+        default="https://github.com/official-stockfish/Stockfish.git",
+        help="URL to clone the Stockfish repo from, if sfRepo does not exist",
+    )
+    parser.add_argument(
+        "--nnueFile",
+        default="nn-82215d0fd0df.nnue",
+        help="a non-embedded master net that is downloaded if missing, '' to skip",
+    )
+    parser.add_argument("--git", default="git", help="git command to use")
+    parser.add_argument("--make", default="make", help="make command to use")
+    parser.add_argument(
+        "--noCommit",
+        action="store_true",
+        help="do not commit and push the results, even with the repo's values",
+    )
+    args = parser.parse_args()
+
+    print("started at: ", datetime.now().ctime(), flush=True)
+    tracker = Tracker(args)
+
+    csvs = {prefix: f"{prefix}{tracker.suffix}.csv" for prefix in args.suites}
+    for prefix, csv in csvs.items():
+        # if necessary, create a new csv file with the correct header
+        if not os.path.isfile(csv):
+            with open(csv, "w") as f:
+                f.write(HEADER + "\n")
+
+        # check if script is already running, using new$csv as lock file
+        new = "new" + csv
+        if os.path.isfile(new):
+            print(f"ERROR: Found '{new}', indicating the script is already running.")
+            print(
+                f"HINT: Merge partial results and/or delete {new} before trying again."
+            )
+            print("      The former can be achieved with")
+            print(f"      'cat {new} >>{csv} && rm {new}'.")
+            print("\nABORTING")
+            sys.exit(1)
+        open(new, "w").close()
+
+    revs, tags = tracker.update()
+
+    # go over the revision list and obtain missing results if necessary
+    todo = []
+    for prefix, csv in csvs.items():
+        with open(csv) as f:
+            csvs[prefix] = csv, f.read()
+    for rev in revs:
+        prefixes = [p for p, (_, content) in csvs.items() if rev not in content]
+        if prefixes:
+            todo.append((rev, prefixes))
+
+    # results are appended in the order of the revisions, as they complete
+    added = {prefix: 0 for prefix in csvs}
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(tracker.track, rev, tags, p) for rev, p in todo]
+        try:
+            while futures:
+                for prefix, line in futures[0].result().items():
+                    append_lines(csvs[prefix][0], [line])
+                    added[prefix] += 1
+                futures.pop(0)
+        except BaseException:
+            executor.shutdown(wait=True, cancel_futures=True)
+            # keep the results of completed later revisions for a manual merge
+            for future in futures:
+                if not future.cancelled() and not future.exception():
+                    for prefix, line in future.result().items():
+                        with open("new" + csvs[prefix][0], "a") as f:
+                            f.write(line + "\n")
+            raise
+
+    for prefix, (csv, _) in csvs.items():
+        os.remove("new" + csv)
+        if added[prefix]:
+            subprocess.run([sys.executable, "plotdata.py", csv], check=True)
+            if tracker.repo and not args.noCommit:
+                png = [f"{prefix}{args.nodes}.png", f"{prefix}{args.nodes}all.png"]
+                subprocess.run(tracker.git + ["add", csv] + png, check=True)
+
+    if tracker.repo and not args.noCommit:
+        if subprocess.run(tracker.git + ["diff", "--staged", "--quiet"]).returncode:
+            subprocess.run(tracker.git + ["commit", "-m", "Update results"], check=True)
+        with open("push.log", "w") as f:
+            subprocess.run(
+                tracker.git + ["push", "origin", "master"], stdout=f, stderr=f
+            )
+
+    print("ended at: ", datetime.now().ctime())
@@ -1,180 +0,0 @@
-#!/bin/bash
-
-# exit on errors
-set -e
-trap 'echo "Error on line $LINENO: $BASH_COMMAND" >&2' ERR
-
-echo "started at: " $(date)
-
-# the repo displays all the revisions from sf_3 to now, excluding some commits
-sf3=aa2368a6878a867fe63247ee2adf2fde3dfe22be
-firstrev=$sf3
-lastrev=HEAD
-exclude=exclude_commits.sha
-nnuefile=nn-82215d0fd0df.nnue # a non-embedded master net
-
-# the repo uses 1M nodes for each position
-nodes=1000000
-suites="matetrack classic"
-
-# check if we run with the repo values
-[ "$firstrev" = "$sf3" ] && [ "$lastrev" = "HEAD" ] && [ "$nodes" = "1000000" ] && repo=yes || repo=no
-
-# use compact file names for the repo
-if [ "$repo" = "yes" ]; then
-  suffix=$nodes # suffix for list of previously computed results
-else
-  suffix=_"$firstrev"_"$lastrev"_"$nodes"
-fi
-out=out.tmp # file for output from matecheck.py
-
-for prefix in $suites; do
-  csv=$prefix$suffix.csv # list of previously computed results
-  new=new$csv            # temporary list of newly computed results
-
-  # if necessary, create a new csv file with the correct header
-  if [[ ! -f $csv ]]; then
-    echo "Commit Date,Commit SHA,Positions,Mates,Best mates,Better mates,Wrong mates,Bad PVs,Release tag" >$csv
-  fi
-
-  # check if script is already running, using $new as lock file
-  if [[ -f $new ]]; then
-    echo "ERROR: Found '$new', indicating the script is already running."
-    echo "HINT: Merge partial results and/or delete $new before trying again."
-    echo "      The former can be achieved with"
-    echo "      'cat $new >>$csv && rm $new'."
-    echo -e "\nABORTING"
-    exit 1
-  else
-    touch $new
-  fi
-done
-
-# clone SF (and download an old, non-embedded master net) as needed
-if [[ ! -e Stockfish ]]; then
-  git clone https://github.com/official-stockfish/Stockfish.git
-fi
-if [[ ! -f $nnuefile ]]; then
-  wget https://tests.stockfishchess.org/api/nn/$nnuefile
-fi
-
-# update SF, get a sorted revision list and all the release tags
-cd Stockfish/src
-git checkout master >&checkout.log
-if ! git fetch origin >&fetch.log; then
-  echo "Failed fetch!"
-  cat fetch.log
-fi
-if ! git pull >&pull.log; then
-  echo "Failed pull"
-  cat pull.log
-fi
-revs=$(git rev-list --reverse $firstrev^..$lastrev)
-
-if output=$(git ls-remote --quiet --tags 2>/dev/null); then
-  tags=$(printf "%s\n" "$output" | grep -E "sf_[0-9]+(\.[0-9]+)?")
-else
-  echo "Failed to ls-remote tags"
-  tags=""
-fi
-
-cd ../..
-
-# go over the revision list and obtain missing results if necessary
-for rev in $revs; do
-  found=1
-  for prefix in $suites; do
-    csv=$prefix$suffix.csv
-    if ! grep -q "$rev" "$csv"; then
-      found=0
-    fi
-  done
-  if [ $found -ne 1 ]; then
-    cd Stockfish/src
-    git checkout $rev >&checkout2.log
-    epoch=$(git show --pretty=fuller --date=iso-strict $rev | grep 'CommitDate' | awk '{print $NF}')
-    tag=$(echo "$tags" | grep $rev | sed 's/.*\///' | sed 's/sf_5\^{}/sf_5/')
-
-    # check if revision SHA is in non-comment section of exclude file
-    if ! sed 's/#.*//' "../../$exclude" | grep -q "$rev"; then
-      echo "compiling revision $rev"
-
-      # compile revision and get binary
-      make clean >&clean.log
-      arch=x86-64-avx2
-      # for very old revisions, we need to fall back to x86-64-modern
-      if ! grep -q "$arch" Makefile; then
-        arch=x86-64-modern
-      fi
-      CXXFLAGS='-march=native' make -j ARCH=$arch profile-build >&make.log
-      mv stockfish ../..
-      cd ../..
-
-      # run a matecheck round on this binary, being nice to other processes
-      nproc_use=$(nproc)
-      if [ $nproc_use -gt 1 ]; then
-        nproc_use=$((3 * nproc_use / 4))
-      fi
-      for prefix in $suites; do
-        csv=$prefix$suffix.csv
-        new=new$csv
-        if ! grep -q "$rev" "$csv"; then
-          epdfile="matetrack.epd"
-          if [ "$prefix" == "classic" ]; then
-            epdfile="classic280.epd"
-          fi
-          echo "running matecheck on $epdfile"
-          nice python3 matecheck.py --epdFile $epdfile --nodes $nodes --concurrency $nproc_use >&$out
-
-          # collect results for this revision
-          total=$(grep "Total FENs:" $out | awk '{print $3}')
-          mates=$(grep "Found mates:" $out | awk '{print $3}')
-          bmates=$(grep "Best mates:" $out | awk '{print $3}')
-          better=$(grep "Better mates:" $out | awk '{print $3}')
-          wrong=$(grep "Wrong mates:" $out | awk '{print $3}')
-          badpvs=$(grep "Bad PVs:" $out | awk '{print $3}')
-
-          # save wrong/better mates and wrong or incomplete PVs for possible debugging
-          if grep -q issues $out; then
-            mv $out out$prefix$suffix.$rev
-          fi
-          echo "$epoch,$rev,$total,$mates,$bmates,$better,$wrong,$badpvs,$tag" >>$new
-        fi
-      done
-    else
-      cd ../..
-      for prefix in $suites; do
-        csv=$prefix$suffix.csv
-        new=new$csv
-        if ! grep -q "$rev" "$csv"; then
-          echo "skipping non-viable revision $rev"
-          total= mates= bmates= better= wrong= badpvs=
-          echo "$epoch,$rev,$total,$mates,$bmates,$better,$wrong,$badpvs,$tag" >>$new
-        fi
-      done
-    fi
-  fi
-done
-
-for prefix in $suites; do
-  csv=$prefix$suffix.csv
-  new=new$csv
-  if [ -s $new ]; then
-    cat $new >>$csv
-    rm $new
-    python3 plotdata.py $csv
-
-    if [ "$repo" = "yes" ]; then
-      git add $csv $prefix$nodes.png $prefix"$nodes"all.png
-    fi
-  else
-    rm -f $new
-  fi
-done
-
-if [ "$repo" = "yes" ]; then
-  git diff --staged --quiet || git commit -m "Update results"
-  git push origin master >&push.log
-fi
-
-echo "ended at: " $(date)
@@ -0,0 +1,161 @@
+import argparse, chess, json, os, re, subprocess, sys, tempfile
+from time import perf_counter
+from matecheck import PVChecker, load_bmfens
+from mockengine import OPTIONS, synthetic_lines
+
+# matecheck.py --bench output -> (benchmark, unit)
+BENCH_LINES = {
+    "UCI info handling": ("UCI info handling", "lines"),
+    "report": ("reporting", "results"),
+}
+
+
+def best_of(repeat, func):
+    """Return the shortest time of repeat calls of func, and its result."""
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_load(args):
+    seconds, bmfens = best_of(args.repeat, lambda: load_bmfens(args.epdFile))
+    return [("load_bmfens", "FENs", len(bmfens), seconds)]
+
+
+def bench_pv_checks(args, fens, options):
+    # the mate and TB win lines of the mock engine, as InfoCollector sees them
+    lines = []
+    for fen in fens:
+        for info in synthetic_lines(chess.Board(fen), options, nodes=args.nodes):
+            m = re.search(r" score (mate|cp) (-?\d+).* pv (.*)", info or "")
+            if m and (m.group(1) == "mate" or abs(int(m.group(2))) > 19000):
+                mate = int(m.group(2)) if m.group(1) == "mate" else None
+                score = int(m.group(2)) if mate is None else None
+                lines.append((fen, mate, score, tuple(m.group(3).split())))
+
+    def check():
+        checkers = {}
+        for fen, mate, score, pv in lines:
+            if fen not in checkers:
+                checkers[fen] = PVChecker(fen)
+            checkers[fen].status(mate, score, pv)
+
+    seconds, _ = best_of(args.repeat, check)
+    return [("PV checks", "PVs", len(lines), seconds)]
+
+
+def bench_matecheck(args, fens, options, rawUci):
+    """Run matecheck.py with the mock engine, and return the rates of the
+    phases that it reports with --bench."""
+    driver = "raw UCI" if rawUci else "python-chess"
+    with tempfile.NamedTemporaryFile("w", suffix=".epd", delete=False) as f:
+        f.writelines(f"{fen} bm #{bm};\n" for fen, bm in fens.items())
+    here = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable, os.path.join(here, "matecheck.py")]
+    cmd += ["--engine", os.path.join(here, "mockengine.py"), "--epdFile", f.name]
+    cmd += ["--nodes", str(args.nodes), "--concurrency", str(args.concurrency)]
+    cmd += ["--engineOpts", json.dumps(options), "--bench"]
+    cmd += ["--rawUci"] if rawUci else []
+    best = {}
+    try:
+        for _ in range(args.repeat):
+            out = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            stats = dict(re.findall(r"^\s*(.*?)\s*:\s*(\S+)", out.stdout, re.M))
+            counts = {"lines": int(stats["UCI info lines"]), "results": len(fens)}
+            cpu = float(stats["CPU us/line"]) * counts["lines"] / 1e6
+            run = {("harness CPU per line", "lines"): cpu}
+            for key, (name, unit) in BENCH_LINES.items():
+                if key == "UCI info handling" and not rawUci:
+                    continue  # python-chess parses in its thread, as search time
+                run[name, unit] = float(stats[key])
+            for key, seconds in run.items():
+                best[key] = min(seconds, best.get(key, seconds))
+    finally:
+        os.unlink(f.name)
+    return [
+        (f"{name} ({driver})", unit, counts[unit], seconds)
+        for (name, unit), seconds in best.items()
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of matecheck.py itself, with the deterministic mock engine in mockengine.py instead of a real engine.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--epdFile",
+        nargs="+",
+        default=["matetrack.epd"],
+        help="file(s) containing the positions and their mate scores",
+    )
+    parser.add_argument(
+        "--positions",
+        type=int,
+        default=500,
+        help="number of positions from EPDFILE to search with the mock engine",
+    )
+    parser.add_argument(
+        "--nodes", type=int, default=10**6, help="nodes limit for the mock engine"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=os.cpu_count(),
+        help="number of mock engines",
+    )
+    parser.add_argument(
+        "--mockOpts",
+        type=json.loads,
+        default={},
+        help="json encoded dictionary of options for the mock engine, e.g. Lines, PVLength, MateLines, TBLines, BoundLines or CrashRate",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="number of repetitions of each benchmark, the fastest counts",
+    )
+    parser.add_argument(
+        "--jsonFile", help="save the throughput of each benchmark to this file"
+    )
+    parser.add_argument(
+        "--compare",
+        help="file saved with --jsonFile by an earlier run, to compare with",
+    )
+    args = parser.parse_args()
+
+    options = {name: opt[1] for name, opt in OPTIONS.items()}
+    options.update(args.mockOpts)
+    bmfens = load_bmfens(args.epdFile)
+    fens = dict(list(bmfens.items())[: args.positions])
+    print(
+        f"Benchmarking with {len(fens)} of {len(bmfens)} positions and mock engine options {json.dumps(args.mockOpts)} ...",
+        flush=True,
+    )
+
+    results = bench_load(args)
+    results += bench_pv_checks(args, fens, options)
+    for rawUci in [False, True]:
+        results += bench_matecheck(args, fens, args.mockOpts, rawUci)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(f"\n{'Benchmark':<44}{'Items':>10}{'Time (s)':>10}{'Items/s':>12}")
+    throughput = {}
+    for name, unit, items, seconds in results:
+        rate = items / seconds if seconds > 0 else float("inf")
+        throughput[name] = rate
+        txt = f"{name:<44}{items:>10}{seconds:>10.3f}{round(rate):>12} {unit}/s"
+        if baseline.get(name):
+            txt += f"  ({rate / baseline[name]:.2f}x)"
+        print(txt)
+    if args.jsonFile:
+        with open(args.jsonFile, "w") as f:
+            json.dump(throughput, f, indent=1)
@@ -1,27 +1,54 @@
-import argparse, random, re, sys, chess, chess.engine, chess.syzygy, logging
-from time import time
-from multiprocessing import freeze_support, cpu_count, active_children, Pool
+import argparse, re, sys, chess, chess.engine, chess.polyglot, chess.syzygy, logging
+import asyncio, copy, dataclasses, gzip, hashlib, math, mmap, shutil, sqlite3, struct, subprocess
+import queue, random, secrets, threading
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from itertools import chain, product, zip_longest
+from time import process_time, time
+from multiprocessing import freeze_support, cpu_count, active_children, Pool, util
+from multiprocessing import Process, Queue
+from multiprocessing.connection import Client, Listener
 from tqdm import tqdm
 import json
 import os, signal
 
 
 class TB:
-    def __init__(self, path, syzygy50MoveRule):
+    def __init__(self, path, syzygy50MoveRule, cacheSize=0):
         self.tb = chess.syzygy.Tablebase()
-        sep = ";" if sys.platform.startswith("win") else ":"
-        count = 0
-        for d in path.split(sep):
-            count += self.tb.add_directory(d, load_dtz=False)
-        print(f"Found {count} tablebases. ", end="")
+        self.count = 0
+        for d in self.directories(path):
+            self.count += self.tb.add_directory(d, load_dtz=False)
+        self.cardinality = self.complete(self.count)
+        self.rule50 = syzygy50MoveRule is None or syzygy50MoveRule.lower() == "true"
+        self.cache = OrderedDict()  # LRU cache of WDL values keyed by Zobrist hash
+        self.cacheSize = cacheSize
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def directories(path):
+        return path.split(";" if sys.platform.startswith("win") else ":")
+
+    @classmethod
+    def tables(cls, path):
+        """Return the number of WDL tables in path, without opening them."""
+        return sum(
+            f.endswith(".rtbw") and chess.syzygy.is_tablename(f[: -len(".rtbw")])
+            for d in cls.directories(path)
+            for f in os.listdir(d)
+        )
+
+    @staticmethod
+    def complete(count):
+        """Return the cardinality of a complete set of count WDL tables."""
         file_counts = [1, 5, 30, 110, 365, 1001]  # https://oeis.org/A018213
-        self.cardinality = cum = 0
+        cardinality = cum = 0
         for idx, c in enumerate(file_counts):
             cum += c
             if cum == count + 1:  # KvK is not part of count
-                self.cardinality = idx + 2
-        assert self.cardinality > 2, "Only incomplete EGTBs found."
-        self.rule50 = syzygy50MoveRule is None or syzygy50MoveRule.lower() == "true"
+                cardinality = idx + 2
+        assert cardinality > 2, "Only incomplete EGTBs found."
+        return cardinality
 
     def probe(self, board, entered_tb):
         if (
@@ -30,77 +57,937 @@ class TB:
             or (not entered_tb and board.halfmove_clock)
         ):
             return None
-        wdl = self.tb.get_wdl(board)
+        key = chess.polyglot.zobrist_hash(board)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            wdl = self.cache[key]
+        else:
+            self.misses += 1
+            wdl = self.tb.get_wdl(board)
+            if self.cacheSize:
+                self.cache[key] = wdl
+                if len(self.cache) > self.cacheSize:
+                    self.cache.popitem(last=False)
         if wdl and not self.rule50 and abs(wdl) == 1:
             wdl *= 2  # turn cursed wins/losses into wins/losses
         return wdl
 
 
-def chunks(lst, n):
-    """Yield successive n-sized chunks from lst."""
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
+def estimate_cost(fen, bm):
+    """Return the expected search time of a position, in arbitrary units."""
+    pieces = sum(c.isalpha() for c in fen.split()[0])
+    # longer mates need deeper searches, whose cost grows faster than the mate
+    # length, positions without bm cannot terminate early, and more pieces mean
+    # fewer nodes per second
+    return (abs(bm) if bm else 100) ** 2 * (1 + pieces / 32)
+
+
+def stratum(fen, bm, byPieces=False):
+    key = abs(bm) if bm else 0
+    if byPieces:
+        key = key, sum(c.isalpha() for c in fen.split()[0]) // 8
+    return key
+
+
+def sample_fens(fens, n, seed, byPieces=False):
+    """Return a sample of n of the (fen, bm) pairs, stratified by |bm| and
+    optionally by the number of pieces, and the sizes of the strata."""
+    strata = {}
+    for fen, bm in sorted(fens, key=lambda fen_bm: fen_bm[0]):
+        strata.setdefault(stratum(fen, bm, byPieces), []).append((fen, bm))
+    assert n >= len(strata), f"--sample needs at least {len(strata)} positions."
+    # one position per stratum, and the others in proportion to the sizes
+    extra, rest = n - len(strata), len(fens) - len(strata)
+    quota = {k: extra * (len(v) - 1) / rest for k, v in strata.items()}
+    alloc = {k: 1 + int(q) for k, q in quota.items()}
+    remainders = sorted(strata, key=lambda k: alloc[k] - quota[k])
+    for k in remainders[: n - sum(alloc.values())]:
+        alloc[k] += 1
+    rng = random.Random(seed)
+    sample = [fb for k, v in strata.items() for fb in rng.sample(v, alloc[k])]
+    return sample, {k: len(v) for k, v in strata.items()}
+
+
+def stratified_estimate(sizes, outcomes, z=1.96):
+    """Return the estimated total and confidence interval of a count, given
+    the sizes of the strata and the lists of 0/1 outcomes of their samples."""
+    total = var = 0
+    for k, size in sizes.items():
+        n, x = len(outcomes[k]), sum(outcomes[k])
+        total += size * x / n
+        if n < size:
+            # shrunk towards 1/2, so that no stratum seems free of uncertainty
+            p = (x + 0.5) / (n + 1)
+            var += size * (size - n) * p * (1 - p) / n
+    half = z * math.sqrt(var)
+    upper = sum(sizes.values())
+    return total, max(0, total - half), min(upper, total + half)
+
+
+def batches(lst, workers, cost):
+    """Yield batches from lst, sorted by decreasing cost, each with about
+    1 / (4 * workers) of the remaining summed cost. The expensive head is
+    sent one item at a time, and the batches shrink again towards the end."""
+    costs = [cost(*item) for item in lst]
+    remaining = sum(costs)
+    i = 0
+    while i < len(lst):
+        target, j, total = remaining / (4 * workers), i + 1, costs[i]
+        while j < len(lst) and total + costs[j] <= target:
+            total += costs[j]
+            j += 1
+        yield lst[i:j]
+        remaining -= total
+        i = j
+
+
+class PVChecker:
+    """Check PVs from one position, resuming from the longest validated prefix
+    shared with an earlier PV that starts with the same move."""
+
+    def __init__(self, fen, tb=None, maxTBscore=0):
+        self.fen, self.tb, self.maxTBscore = fen, tb, maxTBscore
+        self.states = {}  # (losing_side, first move) -> (pv, board, tb_states)
+
+    def status(self, mate, score, pv):
+        # check if the given pv (tuple of uci moves) leads to checkmate #mate
+        # if mate is None, check if pv leads to claimed TB win/loss
+        tb = self.tb
+        losing_side = 1 if (mate and mate > 0) or (score and score > 0) else 0
+        key = losing_side, pv[0] if pv else None
+        try:
+            if key in self.states:
+                # the board holds all the moves of the old pv that passed the checks
+                oldpv, board, tb_states = self.states[key]
+                ply = 0
+                while ply < len(board.move_stack) and ply < len(pv):
+                    if oldpv[ply] != pv[ply]:
+                        break
+                    ply += 1
+                for _ in range(len(board.move_stack) - ply):
+                    board.pop()
+                del tb_states[ply + 1 :]
+            else:
+                ply, board, tb_states = 0, chess.Board(self.fen), [(0, False)]
+            self.states[key] = pv, board, tb_states
+            plies_to_tb, entered_tb = tb_states[ply]  # state before ply is checked
+            for ply in range(ply, len(pv)):
+                move = pv[ply]
+                if ply % 2 == losing_side:
+                    if (tb is None or tb.rule50) and board.can_claim_fifty_moves():
+                        return f"draw: 50mr at ply {ply} for {board.epd()}"
+                    if board.can_claim_threefold_repetition():
+                        return f"draw: 3fold at ply {ply} for {board.epd()}"
+                # if EGTB is available, probe it to check PV correctness
+                if tb is not None:
+                    wdl = tb.probe(board, entered_tb)
+                    if wdl is None:
+                        plies_to_tb += 1
+                    else:
+                        entry = "" if entered_tb else "TB entry at "
+                        entered_tb = True
+                        if abs(wdl) != 2:
+                            return f"draw: wdl = {wdl} at {entry}ply {ply} for {board.epd()}"
+                        if ply % 2 == losing_side and wdl != -2:
+                            return f"wrong: wdl = {wdl} != -2 at {entry}ply {ply} for {board.epd()}"
+                        if ply % 2 != losing_side and wdl != 2:
+                            return f"wrong: wdl = {wdl} != 2 at {entry}ply {ply} for {board.epd()}"
+                uci = chess.Move.from_uci(move)
+                if uci not in board.legal_moves:
+                    raise Exception(f"illegal move {move} at position {board.epd()}")
+                board.push(uci)
+                tb_states.append((plies_to_tb, entered_tb))
+        except Exception as ex:
+            return f'error "{ex}"'
+
+        if mate:
+            plies_to_checkmate = 2 * mate - 1 if mate > 0 else -2 * mate
+            if len(pv) < plies_to_checkmate:
+                return "short"
+            if len(pv) > plies_to_checkmate:
+                return "long"
+            if board.is_checkmate():
+                return "ok"
+            return "wrong"
+
+        # now check if the leaf node is in EGTB, with the correct result
+        wdl = tb.probe(board, entered_tb)
+        if wdl is None or len(pv) == 0:
+            return "short"
+        if self.maxTBscore and plies_to_tb != self.maxTBscore - abs(score):
+            return "wrong TB entry"
+        if abs(wdl) != 2:
+            return f"draw: wdl = {wdl} at leaf {board.epd()}"
+        if len(pv) % 2 == losing_side and wdl != -2:
+            return f"wrong: wdl = {wdl} != -2 at leaf {board.epd()}"
+        if len(pv) % 2 != losing_side and wdl != 2:
+            return f"wrong: wdl = {wdl} != 2 at leaf {board.epd()}"
+        return "ok"
 
 
 def pv_status(fen, mate, score, pv, tb=None, maxTBscore=0):
-    # check if the given pv (tuple of uci moves) leads to checkmate #mate
-    # if mate is None, check if pv leads to claimed TB win/loss
-    losing_side = 1 if (mate and mate > 0) or (score and score > 0) else 0
-    plies_to_tb, entered_tb = 0, False
-    try:
-        board = chess.Board(fen)
-        for ply, move in enumerate(pv):
-            if ply % 2 == losing_side:
-                if (tb is None or tb.rule50) and board.can_claim_fifty_moves():
-                    return f"draw: 50mr at ply {ply} for {board.epd()}"
-                if board.can_claim_threefold_repetition():
-                    return f"draw: 3fold at ply {ply} for {board.epd()}"
-            # if EGTB is available, probe it to check PV correctness
-            if tb is not None:
-                wdl = tb.probe(board, entered_tb)
-                if wdl is None:
-                    plies_to_tb += 1
+    return PVChecker(fen, tb, maxTBscore).status(mate, score, pv)
+
+
+class IssueFinder:
+    """Find the issues in the UCI info lines of a position for the report."""
+
+    def __init__(self, args, multipv_fens=None):
+        self.maxValidMate = args.maxValidMate
+        self.minValidMate = args.minValidMate
+        self.shortTBPVonly = args.shortTBPVonly
+        self.tb = args.syzygyPath is not None
+        self.multipv_fens = multipv_fens
+
+    def bad_tb_pv(self, status):
+        return (
+            (status != "ok" and not self.shortTBPVonly)
+            or status == "short"
+            or "TB entry" in status
+        )
+
+    def issues(self, fen, bestmate, pvstatus):
+        """Yield (line, multipv, issue, txt, pv) for all issues with the lines."""
+        for line, (status, _) in pvstatus.items():
+            multipv, mate, score, pv = line
+            if mate and (mate > self.maxValidMate or mate < self.minValidMate):
+                txt = f"Found invalid mate #{mate} outside of [{self.minValidMate}, {self.maxValidMate}]"
+                yield line, multipv, "Invalid mate scores", txt, None
+            if pv == "bound":
+                continue
+            if mate:
+                if bestmate:
+                    if mate * bestmate > 0:
+                        if abs(mate) < abs(bestmate) and (multipv == 1 or mate > 0):
+                            txt = f"Found mate #{mate} (better)"
+                            yield line, multipv, "Better mates", txt, None
+                        if status != "ok":
+                            txt = f'Found mate #{mate} with PV status "{status}"'
+                            yield line, multipv, "Bad PVs", txt, pv
+                    elif multipv == 1 or mate > 0:
+                        txt = f"Found mate #{mate} (wrong sign)"
+                        yield line, multipv, "Wrong mates", txt, None
+                elif mate:
+                    txt = f"Found mate #{mate} (unexpected)"
+                    yield line, multipv, "Unexpected mates", txt, None
+            elif self.tb:
+                if bestmate:
+                    if score * bestmate > 0:
+                        if self.bad_tb_pv(status):
+                            txt = f'Found TB score {score} with PV status "{status}"'
+                            yield line, multipv, "Bad PVs", txt, pv
+                    elif multipv == 1 or score > 0:
+                        txt = f"Found TB score {score} (wrong sign)"
+                        yield line, multipv, "Wrong TB scores", txt, None
                 else:
-                    entry = "" if entered_tb else "TB entry at "
-                    entered_tb = True
-                    if abs(wdl) != 2:
-                        return (
-                            f"draw: wdl = {wdl} at {entry}ply {ply} for {board.epd()}"
-                        )
-                    if ply % 2 == losing_side and wdl != -2:
-                        return f"wrong: wdl = {wdl} != -2 at {entry}ply {ply} for {board.epd()}"
-                    if ply % 2 != losing_side and wdl != 2:
-                        return f"wrong: wdl = {wdl} != 2 at {entry}ply {ply} for {board.epd()}"
+                    txt = f"Found TB score {score} (unexpected)"
+                    yield line, multipv, "Unexpected TB scores", txt, None
+
+    def multipv_issues(self, fen, bestmate, pvstatus):
+        """Yield the issues found by comparing with the positions' children."""
+        if not self.multipv_fens:
+            return
+
+        # check mate and TB scores in MultiPV lines for correctness
+        for line, (status, _) in pvstatus.items():
+            multipv, mate, score, pv = line
+            if not (mate or self.tb) or not pv or pv == "bound":
+                continue
+            board = chess.Board(fen)
+            move = pv[0]
             uci = chess.Move.from_uci(move)
             if uci not in board.legal_moves:
-                raise Exception(f"illegal move {move} at position {board.epd()}")
+                txt = f"Found illegal root move {move}"
+                yield line, multipv, "Bad PVs", txt, pv
+                continue
             board.push(uci)
-    except Exception as ex:
-        return f'error "{ex}"'
+            child = board.epd()
+            if child not in self.multipv_fens:
+                continue
+            childbm = self.multipv_fens[child]
+            if childbm:  # adjust to root PoV
+                childbm = -childbm + (1 if childbm < 0 else 0)
+            if mate:
+                if childbm:
+                    if mate * childbm > 0:
+                        if abs(mate) < abs(childbm):
+                            txt = f"Found mate #{mate} (better than #{childbm}) for move {move}"
+                            yield line, multipv, "Better mates", txt, None
+                        if status != "ok":
+                            txt = f'Found mate #{mate} for move {move} with PV status "{status}"'
+                            yield line, multipv, "Bad PVs", txt, pv
+                    else:
+                        txt = f"Found mate #{mate} (wrong sign wrt #{childbm}) for move {move}"
+                        yield line, multipv, "Wrong mates", txt, None
+                else:
+                    txt = f"Found mate #{mate} (unexpected) for move {move}"
+                    yield line, multipv, "Unexpected mates", txt, None
+            elif self.tb:
+                if childbm:
+                    if score * childbm > 0:
+                        if self.bad_tb_pv(status):
+                            txt = f'Found TB score {score} (for #{childbm}) with PV status "{status}" for move {move}'
+                            yield line, multipv, "Bad PVs", txt, pv
+                    else:
+                        txt = f"Found TB score {score} (wrong sign wrt #{childbm}) for move {move}"
+                        yield line, multipv, "Wrong TB scores", txt, None
+                else:
+                    txt = f"Found TB score {score} (unexpected) for move {move}"
+                    yield line, multipv, "Unexpected TB scores", txt, None
 
-    if mate:
-        plies_to_checkmate = 2 * mate - 1 if mate > 0 else -2 * mate
-        if len(pv) < plies_to_checkmate:
-            return "short"
-        if len(pv) > plies_to_checkmate:
-            return "long"
-        if board.is_checkmate():
-            return "ok"
-        return "wrong"
-
-    # now check if the leaf node is in EGTB, with the correct result
-    wdl = tb.probe(board, entered_tb)
-    if wdl is None or len(pv) == 0:
-        return "short"
-    if maxTBscore and plies_to_tb != maxTBscore - abs(score):
-        return "wrong TB entry"
-    if abs(wdl) != 2:
-        return f"draw: wdl = {wdl} at leaf {board.epd()}"
-    if (ply + 1) % 2 == losing_side and wdl != -2:
-        return f"wrong: wdl = {wdl} != -2 at leaf {board.epd()}"
-    if (ply + 1) % 2 != losing_side and wdl != 2:
-        return f"wrong: wdl = {wdl} != 2 at leaf {board.epd()}"
-    return "ok"
+    def compact(self, fen, bestmate, pvstatus, showAllIssues=False):
+        """Keep only the lines shown in the report, and count the other issues."""
+        keep, seen, issues = set(), set(), []
+        for line, multipv, key, _, _ in chain(
+            self.issues(fen, bestmate, pvstatus),
+            self.multipv_issues(fen, bestmate, pvstatus),
+        ):
+            key = key if multipv == 1 else "MultiPV " + key
+            if key not in seen or showAllIssues:
+                keep.add(line)
+                seen.add(key)
+            issues.append((line, key))
+        pvstatus = {
+            line: value
+            for line, value in pvstatus.items()
+            if line in keep or value[1]  # the final line is needed for mate counts
+        }
+        dropped = Counter(key for line, key in issues if line not in pvstatus)
+        return pvstatus, dropped
+
+
+class Report:
+    """Aggregate the results of the positions as they become available."""
+
+    def __init__(self, args, finder, maxbm, tb=False, jsonlFile=None, verbose=True):
+        self.args, self.finder, self.tb = args, finder, tb
+        self.verbose = verbose  # print the issues and crashes as they are found
+        self.jsonlFile = jsonlFile  # open file for the per-position records
+        self.mates = self.bestmates = self.tbwins = 0
+        self.issue = {}
+        for txt in [
+            "Invalid mate scores",
+            "Better mates",
+            "Wrong mates",
+            "Unexpected mates",
+            "Bad PVs",
+            "Wrong TB scores",
+            "Unexpected TB scores",
+        ]:
+            for prefix in ["", "MultiPV "]:
+                self.issue[prefix + txt] = [0, 0]
+        self.issue["Crashed positions"] = [0, 0]
+        self.bestnodes = [[] for _ in range(maxbm + 1)]
+        self.bestdepth = [[] for _ in range(maxbm + 1)]
+        self.foundmates = {}
+        self.missedmates = set()
+        self.totalnodes = self.totaltime = 0
+
+    def add(self, result):
+        fen, bestmate, pvstatus, nodes, depth, lastnodes, lasttime, dropped = result[:8]
+        args, issue = self.args, self.issue
+        if pvstatus is None:
+            issue["Crashed positions"][0] += 1
+            issue["Crashed positions"][1] += 1
+            if self.verbose:
+                tqdm.write(f'Engine crashed for FEN "{fen}" in all attempts.')
+            self.missedmates.add(fen)
+            if self.jsonlFile is not None:
+                record = {"fen": fen, "bm": bestmate, "status": "crashed"}
+                self.jsonlFile.write(json.dumps(record) + "\n")
+                self.jsonlFile.flush()
+            return
+        found_mate, final_line = None, None
+        found_issues = set()
+        issues = Counter(dropped)  # for the record all issues are counted
+
+        def record_issue(multipv, key, txt, fen, bm, pv=None):
+            if multipv != 1:
+                key = "MultiPV " + key
+                txt = f"multipv{multipv}: " + txt
+            issue[key][0] += 1
+            issues[key] += 1
+            first_time = key not in found_issues
+            if first_time or args.showAllIssues:
+                issue[key][1] += int(first_time)
+                found_issues.add(key)
+                if not self.verbose:
+                    return
+                txt += (
+                    f' for FEN "{fen}" '
+                    + (f" with bm #{bm}." if bm else " without bm.")
+                    + (f"\nPV: {' '.join(pv)}" if pv else "")
+                )
+                tqdm.write(txt)
+
+        for key, count in dropped.items():
+            issue[key][0] += count
+
+        for (multipv, mate, score, pv), (status, last_line) in pvstatus.items():
+            if last_line:
+                final_line = mate, score, pv, status
+            #  for mate counts use last valid UCI info output
+            if not last_line or not bestmate:
+                continue
+            if mate:
+                if mate * bestmate > 0:
+                    self.mates += 1
+                    self.foundmates[fen] = mate
+                    if mate == bestmate:
+                        self.bestmates += 1
+                        self.bestnodes[abs(mate)].append(nodes)
+                        self.bestdepth[abs(mate)].append(depth)
+                    found_mate = mate
+            elif self.tb and score * bestmate > 0:
+                self.tbwins += 1
+
+        for _, multipv, key, txt, pv in self.finder.issues(fen, bestmate, pvstatus):
+            record_issue(multipv, key, txt, fen, bestmate, pv)
+
+        if found_mate is None:
+            self.missedmates.add(fen)
+
+        if args.mate == 0 and self.verbose:
+            if found_mate is None:
+                tqdm.write(f'Did not find mate for FEN "{fen}" with bm #{bestmate}.')
+            elif found_mate != bestmate:
+                tqdm.write(
+                    f'Only found mate #{found_mate} for FEN "{fen}" with bm #{bestmate}.'
+                )
+
+        for _, multipv, key, txt, pv in self.finder.multipv_issues(
+            fen, bestmate, pvstatus
+        ):
+            record_issue(multipv, key, txt, fen, bestmate, pv)
+
+        self.totalnodes += lastnodes
+        self.totaltime += lasttime
+
+        if self.jsonlFile is not None:
+            mate, score, pv, status = final_line or (None, None, None, None)
+            record = {
+                "fen": fen,
+                "bm": bestmate,
+                "mate": mate,
+                "score": score,
+                "pv": pv,
+                "status": status,
+                "nodes": nodes,
+                "depth": depth,
+                "totalnodes": lastnodes,
+                "time": lasttime,
+                "issues": issues,
+            }
+            self.jsonlFile.write(json.dumps(record) + "\n")
+            self.jsonlFile.flush()
+
+
+def best_mate_found(result):
+    """Return True if the final line of a result announces the best mate."""
+    bm, pvstatus = result[1], result[2]
+    if not bm or pvstatus is None:
+        return False
+    return any(
+        last_line and mate == bm for (_, mate, _, _), (_, last_line) in pvstatus.items()
+    )
+
+
+class SPRT:
+    """A sequential version of McNemar's test for paired outcomes: on the
+    positions where only one engine finds the best mate, two one-sided SPRTs
+    test p = 1/2 against p = 1/2 + delta and p = 1/2 - delta, where p is the
+    chance that it is engine B."""
+
+    def __init__(self, alpha, beta, delta):
+        self.lower = math.log(beta / (1 - alpha / 2))
+        self.upper = math.log((1 - beta) / (alpha / 2))
+        self.win, self.loss = math.log(1 + 2 * delta), math.log(1 - 2 * delta)
+        self.outcomes = {}  # fen -> [found by A, found by B]
+        self.pairs = self.both = self.a = self.b = self.neither = 0
+        self.result = None
+
+    def llr(self):
+        """Return the log-likelihood ratios for B better and for A better."""
+        return (
+            self.b * self.win + self.a * self.loss,
+            self.a * self.win + self.b * self.loss,
+        )
+
+    def add(self, fen, variant, found):
+        pair = self.outcomes.setdefault(fen, [None, None])
+        pair[variant] = found
+        if None in pair:
+            return
+        del self.outcomes[fen]
+        self.pairs += 1
+        if pair[0] and pair[1]:
+            self.both += 1
+        elif pair[0]:
+            self.a += 1
+        elif pair[1]:
+            self.b += 1
+        else:
+            self.neither += 1
+        if self.result is None:
+            b_better, a_better = self.llr()
+            if b_better >= self.upper:
+                self.result = "B finds more best mates"
+            elif a_better >= self.upper:
+                self.result = "A finds more best mates"
+            elif b_better <= self.lower and a_better <= self.lower:
+                self.result = "no difference"
+
+
+# the phases in the --bench summary, with their nesting level
+PHASES = [
+    ("load", 0),
+    ("engine start", 0),
+    ("engine configure", 0),
+    ("position", 0),
+    ("engine search", 1),
+    ("UCI info handling", 1),
+    ("PV checks", 2),
+    ("TB probes", 3),
+    ("result", 1),
+    ("transfer", 0),
+    ("report", 0),
+]
+
+# exceptions after which the engine is restarted and the position searched again
+ENGINE_FAILURES = (
+    chess.engine.EngineTerminatedError,
+    chess.engine.EngineError,
+    TimeoutError,
+    asyncio.TimeoutError,
+)
+
+
+def warn_restart(fen, ex):
+    print(
+        f'\nWARNING: Engine failed for FEN "{fen}" ({type(ex).__name__}: {ex}). Restarting the engine.',
+        file=sys.stderr,
+    )
+
+
+class Profiler:
+    """Time the phases of a run, as totals for --bench and as Chrome trace
+    events for --profileTrace."""
+
+    def __init__(self, trace=False, name=None):
+        self.totals = Counter()  # phase -> seconds
+        self.events = None
+        if trace:
+            meta = {"ph": "M", "pid": os.getpid(), "tid": 0}
+            self.events = [{"name": "process_name", "args": {"name": name}, **meta}]
+
+    def add(self, name, start, duration, pid=None, tid=0, **args):
+        self.totals[name] += duration
+        if self.events is not None:
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": round(start * 1e6),
+                    "dur": round(duration * 1e6),
+                    "pid": pid or os.getpid(),
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+
+    @contextmanager
+    def span(self, name, **args):
+        start = time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time() - start, **args)
+
+    def timed(self, func, times, name):
+        """Return func, with the time spent in it added to times[name]. If
+        times is None, it is added to the totals as they are at each call, as
+        flush replaces them."""
+
+        def wrapper(*args):
+            start = time()
+            try:
+                return func(*args)
+            finally:
+                (self.totals if times is None else times)[name] += time() - start
+
+        return wrapper
+
+    def position(self, start, collector, tid=0):
+        """Return the result of collector, and record the span of its position."""
+        times = collector.times
+        begin = time()
+        result = collector.result()
+        times["result"] += time() - begin
+        self.totals.update(times)
+        ms = {k: round(v * 1e3, 3) for k, v in times.items()}
+        self.add("position", start, time() - start, tid=tid, fen=collector.fen, **ms)
+        return result
+
+    def flush(self):
+        """Return and reset what was recorded, for the main process."""
+        data = self.totals, self.events, os.getpid(), time()
+        self.totals = Counter()
+        self.events = None if self.events is None else []
+        return data
+
+
+profiler = None  # the Profiler of this process, with --bench or --profileTrace
+
+
+def span(name, **args):
+    return nullcontext() if profiler is None else profiler.span(name, **args)
+
+
+def info_line(info):
+    """Return the UCI info line, without the leading info, of a python-chess
+    info dict, as far as it is used by InfoCollector."""
+    tokens = []
+    for key in ["depth", "seldepth", "multipv"]:
+        if key in info:
+            tokens += [key, str(info[key])]
+    if "score" in info:
+        score = info["score"].relative
+        if score.is_mate():
+            tokens += ["score", "mate", str(score.mate())]
+        else:
+            tokens += ["score", "cp", str(score.score())]
+        tokens += [bound for bound in ["lowerbound", "upperbound"] if bound in info]
+    if "nodes" in info:
+        tokens += ["nodes", str(info["nodes"])]
+    if "time" in info:
+        tokens += ["time", str(round(info["time"] * 1000))]
+    if "pv" in info:
+        tokens += ["pv"] + [move.uci() for move in info["pv"]]
+    return " ".join(tokens)
+
+
+def parse_info(tokens):
+    """Parse the fields of a tokenized UCI info line that are needed here.
+    The score is returned as a (cp, mate) pair and the pv as UCI strings."""
+    info, i, n = {}, 0, len(tokens)
+    try:
+        while i < n:
+            token = tokens[i]
+            if token in ("depth", "multipv", "nodes"):
+                info[token] = int(tokens[i + 1])
+                i += 2
+            elif token == "time":
+                info["time"] = int(tokens[i + 1]) / 1000
+                i += 2
+            elif token == "score":
+                kind, value = tokens[i + 1], int(tokens[i + 2])
+                info["score"] = (value, None) if kind == "cp" else (None, value)
+                i += 3
+                if i < n and tokens[i] in ("lowerbound", "upperbound"):
+                    info["bound"] = True
+                    i += 1
+            elif token == "pv":
+                j = i + 1
+                while j < n and chess.engine.UCI_REGEX.match(tokens[j]):
+                    j += 1
+                info["pv"] = tokens[i + 1 : j]
+                i = j
+            elif token == "string":
+                break
+            else:
+                i += 1
+    except (ValueError, IndexError):
+        logging.error("Exception parsing info: %s", " ".join(tokens))
+    return info
+
+
+class RawUciEngine:
+    """A minimal UCI client that passes the engine's info lines on unparsed.
+    It mimics the commands python-chess sends for an analysis."""
+
+    def __init__(self, command):
+        self.process = subprocess.Popen(
+            [command],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.options = {}  # lower case name -> name
+        self.defaults = {}  # lower case name -> default value
+        self.config = {}
+        self.send("uci")
+        for line in self.lines():
+            if line.startswith("option name "):
+                name, _, rest = line[len("option name ") :].partition(" type ")
+                name = name.strip()
+                self.options[name.lower()] = name
+                default = re.search(r" default (.*?)(?: min | max | var |$)", rest)
+                if default:
+                    self.defaults[name.lower()] = default.group(1).strip()
+            elif line.strip() == "uciok":
+                break
+
+    def send(self, line):
+        logging.debug("%s << %s", self.process.pid, line)
+        try:
+            self.process.stdin.write(line + "\n")
+            self.process.stdin.flush()
+        except OSError:
+            raise chess.engine.EngineTerminatedError("engine process died")
+
+    def lines(self):
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise chess.engine.EngineTerminatedError(
+                    f"engine process died unexpectedly (exit code: {self.process.poll()})"
+                )
+            logging.debug("%s >> %s", self.process.pid, line.rstrip())
+            yield line
+
+    def setoption(self, name, value):
+        if value is not None and self.config.get(name) == value:
+            return
+        if value is None:
+            self.send(f"setoption name {name}")
+        elif value is True or value is False:
+            self.send(f"setoption name {name} value {str(value).lower()}")
+        else:
+            self.send(f"setoption name {name} value {value}")
+        self.config[name] = value
+
+    def configure(self, options):
+        for name, value in options.items():
+            if name.lower() not in self.options:
+                raise chess.engine.EngineError(
+                    f"engine does not support option {name} (available options: {', '.join(sorted(self.options.values()))})"
+                )
+            self.setoption(self.options[name.lower()], value)
+
+    def analysis(self, board, limit, multipv=None):
+        """Search a new game from board, and yield the info lines until bestmove."""
+        if "ponder" in self.options:
+            self.setoption(self.options["ponder"], False)
+        analysemode = self.options.get("uci_analysemode")
+        if analysemode is not None and analysemode not in self.config:
+            self.setoption(analysemode, True)
+        if "multipv" in self.options or (multipv and multipv > 1):
+            self.configure({"MultiPV": 1 if multipv is None else multipv})
+        self.send("ucinewgame")
+        self.send("isready")
+        for line in self.lines():
+            if line.strip() == "readyok":
+                break
+        self.send(f"position fen {board.fen()}")
+        go = ["go"]
+        if limit.white_clock is not None:
+            go += ["wtime", str(max(1, round(limit.white_clock * 1000)))]
+        if limit.black_clock is not None:
+            go += ["btime", str(max(1, round(limit.black_clock * 1000)))]
+        if limit.white_inc is not None:
+            go += ["winc", str(round(limit.white_inc * 1000))]
+        if limit.black_inc is not None:
+            go += ["binc", str(round(limit.black_inc * 1000))]
+        if limit.depth is not None:
+            go += ["depth", str(max(1, int(limit.depth)))]
+        if limit.nodes is not None:
+            go += ["nodes", str(max(1, int(limit.nodes)))]
+        if limit.mate is not None:
+            go += ["mate", str(max(1, int(limit.mate)))]
+        if limit.time is not None:
+            go += ["movetime", str(max(1, round(limit.time * 1000)))]
+        self.send(" ".join(go))
+        for line in self.lines():
+            if line.startswith("info "):
+                yield line[len("info ") :]
+            elif line.startswith("bestmove"):
+                return
+
+    def stop(self):
+        """Stop the search, and skip its remaining output up to bestmove."""
+        self.send("stop")
+        for line in self.lines():
+            if line.startswith("bestmove"):
+                return
+
+    def quit(self):
+        try:
+            self.send("quit")
+            self.process.wait(timeout=10)
+        except (chess.engine.EngineTerminatedError, subprocess.TimeoutExpired):
+            self.close()
+
+    def close(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class InfoCollector:
+    """Collect the decisive scores in the UCI info lines of one position."""
+
+    def __init__(self, ana, tb, fen, bm):
+        self.ana, self.fen, self.bm = ana, fen, bm
+        self.board = chess.Board(fen)
+        self.pvstatus = {}  #  stores (status, final_line)
+        self.mate_checker = PVChecker(fen)
+        self.tb_checker = PVChecker(fen, tb, ana.maxTBscore)
+        self.nodes = self.depth = self.lastnodes = self.lasttime = 0
+        if ana.mate is not None and ana.mate == 0 and bm:
+            self.limit = chess.engine.Limit(
+                nodes=ana.nodes, depth=ana.depth, time=ana.time, mate=abs(bm)
+            )
+        else:
+            self.limit = ana.limit
+        self.lastkey = None
+        self.lines = 0  # number of info lines seen
+        self.seen = {}  # nodes at which each line was first seen, for --nodesCurve
+        self.stop = False  # True once a best mate with a valid PV was found
+        self.finals = []  # (lastnodes, lasttime, lastkey, nodes, depth) for multipv 1
+        self.legal = {}  # raw PVs that were checked for legality
+        self.recorded = [] if ana.record else None  # the info lines, for --record
+        if profiler is not None:
+            self.times = times = Counter()  # phase -> seconds, for this position
+            self.add = profiler.timed(self.add, times, "UCI info handling")
+            self.add_raw = profiler.timed(self.add_raw, times, "UCI info handling")
+            for checker in self.mate_checker, self.tb_checker:
+                checker.status = profiler.timed(checker.status, times, "PV checks")
+
+    def add(self, info):
+        self.lines += 1
+        if self.recorded is not None and ("score" in info or "nodes" in info):
+            self.recorded.append(info_line(info))
+        self.lastnodes = info.get("nodes", self.lastnodes)
+        self.lasttime = info.get("time", self.lasttime)
+        if "score" not in info:
+            return
+        score = info["score"].pov(self.board.turn)
+        self.add_score(
+            info.get("multipv", 1),
+            score.mate(),
+            score.score(),
+            "upperbound" in info or "lowerbound" in info,
+            info.get("pv", ()),
+            info.get("depth", 0),
+        )
+
+    def add_raw(self, line):
+        """Add an unparsed UCI info line, as yielded by RawUciEngine. Only
+        lines with a score are parsed fully, and moves are kept as strings."""
+        self.lines += 1
+        if line.startswith("string"):
+            return
+        tokens = line.split()
+        if self.recorded is not None and ("score" in tokens or "nodes" in tokens):
+            self.recorded.append(line.strip())
+        if "score" not in tokens:
+            for i, token in enumerate(tokens[:-1]):
+                if token == "nodes":
+                    self.lastnodes = int(tokens[i + 1])
+                elif token == "time":
+                    self.lasttime = int(tokens[i + 1]) / 1000
+                elif token == "string":
+                    break
+            return
+        info = parse_info(tokens)
+        self.lastnodes = info.get("nodes", self.lastnodes)
+        self.lasttime = info.get("time", self.lasttime)
+        if "score" not in info:
+            return
+        cp, m = info["score"]  # relative to the side to move, as in python-chess
+        pv = info.get("pv", ())
+        self.add_score(
+            info.get("multipv", 1),
+            m,
+            cp,
+            "bound" in info,
+            pv,
+            info.get("depth", 0),
+            check_pv=bool(pv),
+        )
+
+    def add_score(self, multipv, m, score, bound, pv, depth, check_pv=False):
+        pvstatus = self.pvstatus
+        if multipv == 1:
+            self.lastkey = None
+        if bound:
+            if m:
+                pvstatus[multipv, m, None, "bound"] = "", False
+                self.seen.setdefault((multipv, m, None, "bound"), self.lastnodes)
+            if multipv == 1:
+                self.add_final()
+            return
+        if m is None and (
+            self.ana.syzygyPath is None
+            or score is None
+            or abs(score) < self.ana.minTBscore
+        ):
+            if multipv == 1:
+                self.add_final()
+            return
+        pv = tuple(map(str, pv))
+        if check_pv:
+            pv = self.legal_pv(pv)
+        if (multipv, m, score, pv) not in pvstatus:
+            # mate PVs are checked without the help of EGTBs
+            if m:
+                status = self.mate_checker.status(m, score, pv)
+            elif m is None:
+                status = self.tb_checker.status(m, score, pv)
+            else:
+                status = "None"  # mate 0 for a checkmated root
+            pvstatus[multipv, m, score, pv] = status, False
+            self.seen[multipv, m, score, pv] = self.lastnodes
+        if multipv == 1:
+            self.nodes = self.lastnodes
+            self.depth = depth
+            self.lastkey = 1, m, score, pv
+            self.add_final()
+            if self.ana.stopOnBestMate and m and m == self.bm:
+                self.stop = pvstatus[self.lastkey][0] == "ok"
+
+    def add_final(self):
+        if self.ana.nodesCurve:
+            final = self.lastnodes, self.lasttime, self.lastkey, self.nodes, self.depth
+            self.finals.append(final)
+
+    def legal_pv(self, pv):
+        """Like python-chess, drop a raw PV that contains an illegal move."""
+        if pv not in self.legal:
+            board = self.board.copy(stack=False)
+            try:
+                for move in pv:
+                    board.push_uci(move)
+                self.legal[pv] = pv
+            except ValueError:
+                self.legal[pv] = ()
+        return self.legal[pv]
+
+    def result(self, budget=None):
+        """Return the result tuple, or for budget the result as it would have
+        been with a nodes limit of budget, as far as the info lines tell."""
+        fen, bm, pvstatus = self.fen, self.bm, self.pvstatus
+        lastkey, nodes, depth = self.lastkey, self.nodes, self.depth
+        lastnodes, lasttime = self.lastnodes, self.lasttime
+        curve = []
+        if budget is not None:
+            pvstatus = {k: v for k, v in pvstatus.items() if self.seen[k] <= budget}
+            lastnodes, lasttime, lastkey, nodes, depth = (0, 0, None, 0, 0)
+            for final in self.finals:
+                if final[0] > budget:
+                    break
+                lastnodes, lasttime, lastkey, nodes, depth = final
+        elif self.ana.nodesCurve:
+            curve = [(b, self.result(b)) for b in self.ana.nodesCurve[:-1]]
+        if lastkey in pvstatus:  # mark final info line for best move
+            pvstatus[lastkey] = pvstatus[lastkey][0], True
+        dropped = {}  # issue counts for lines that were not kept
+        if self.ana.finder is not None:
+            pvstatus, dropped = self.ana.finder.compact(
+                fen, bm, pvstatus, self.ana.showAllIssues
+            )
+        return fen, bm, pvstatus, nodes, depth, lastnodes, lasttime, dropped, curve
 
 
 class Analyser:
@@ -131,115 +1018,907 @@ class Analyser:
         self.evalFile = args.evalFile
         self.syzygy50MoveRule = args.syzygy50MoveRule
         self.minTBscore = args.minTBscore
+        self.maxTBscore = args.maxTBscore
+        self.tbCacheSize = args.tbCacheSize
+        self.showAllIssues = args.showAllIssues
+        self.retries = args.retries
+        self.positionTimeout = args.positionTimeout
+        self.finder = None  # an IssueFinder, if only the needed lines are kept
         self.engineOpts = args.engineOpts
+        self.rawUci = args.rawUci
+        self.nodesCurve = args.nodesCurve
+        self.stopOnBestMate = args.stopOnBestMate
+        self.variant = 0  # index of the engine, or of its options, that is compared
+        self.suite = None  # a compiled suite that the pool workers read from
+        self.lines = 0  # UCI info lines seen by this process
+        self.profile = args.bench or args.profileTrace is not None
+        self.trace = args.profileTrace is not None
+        self.record = args.record is not None
+        self.replay = args.replay is not None
+        self.records = []  # (fen, bm, info lines or None if crashed) for --record
+
+    def engine_options(self):
+        options = {}
+        if self.threads is not None:
+            options["Threads"] = self.threads
+        if self.hash is not None:
+            options["Hash"] = self.hash
+        if self.evalFile is not None:
+            options["EvalFile"] = self.evalFile
+        if self.syzygyPath is not None:
+            options["SyzygyPath"] = self.syzygyPath
+        if self.syzygy50MoveRule is not None:
+            options["Syzygy50MoveRule"] = self.syzygy50MoveRule
+        if self.engineOpts is not None:
+            options.update(self.engineOpts)
+        return options
+
+    def open_engine(self):
+        with span("engine start"):
+            if self.rawUci:
+                engine = RawUciEngine(self.engine)
+            else:
+                engine = chess.engine.SimpleEngine.popen_uci(
+                    self.engine, timeout=self.timeout
+                )
+        with span("engine configure"):
+            engine.configure(self.engine_options())
+        return engine
+
+    def worker_engine(self):
+        """Return the pool worker's engine for self.engine, configured with the
+        options of this Analyser. Analysers that only differ in their options
+        share the engine, and options they do not set are reset to default."""
+        engine = worker_engines.get(self.engine)
+        options = self.engine_options()
+        if engine is None:
+            engine = worker_engines[self.engine] = self.open_engine()
+        elif options != worker_options[self.engine]:
+            if self.rawUci:
+                defaults = engine.defaults
+            else:
+                defaults = {n.lower(): o.default for n, o in engine.options.items()}
+            changes = {
+                name: defaults[name.lower()]
+                for name in worker_options[self.engine]
+                if name not in options and defaults.get(name.lower()) is not None
+            }
+            changes.update(options)
+            with span("engine configure"):
+                engine.configure(changes)  # only changed values are sent
+        worker_options[self.engine] = options
+        return engine
+
+    def engine_memory(self):
+        """Return the memory in MB of an engine configured with all the options
+        but the hash, and the hash size in MB it will use."""
+        engine = chess.engine.SimpleEngine.popen_uci(self.engine, timeout=self.timeout)
+        try:
+            options = self.engine_options()
+            hash = options.pop("Hash", None)
+            engine.configure(options)
+            engine.ping()  # the engine has loaded its net
+            if hash is None:
+                hash = engine.options["Hash"].default if "Hash" in engine.options else 0
+            return rss(engine.transport.get_pid()), hash
+        finally:
+            engine.quit()
+
+    def open_tb(self):
+        if self.syzygyPath is None:
+            return None
+        tb = TB(self.syzygyPath, self.syzygy50MoveRule, self.tbCacheSize)
+        if profiler is not None:
+            tb.probe = profiler.timed(tb.probe, None, "TB probes")
+        return tb
+
+    @contextmanager
+    def watchdog(self, engine):
+        """Close the engine if the search of a position takes longer than
+        positionTimeout, so that it is restarted as after a crash."""
+        if self.positionTimeout is None:
+            yield
+            return
+        lock, finished, expired = threading.Lock(), threading.Event(), threading.Event()
+
+        def expire():
+            with lock:  # unless the search has just finished
+                if finished.is_set():
+                    return
+                expired.set()
+            engine.close()
+
+        timer = threading.Timer(self.positionTimeout, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        except ENGINE_FAILURES:
+            if not expired.is_set():
+                raise
+        finally:
+            timer.cancel()
+            with lock:
+                finished.set()
+        if expired.is_set():
+            raise self.timeout_error()
+
+    def timeout_error(self):
+        return TimeoutError(
+            f"search did not finish within {self.positionTimeout} seconds"
+        )
+
+    def analyze_fen(self, engine, tb, fen, bm):
+        with self.watchdog(engine):
+            return self.search_fen(engine, tb, fen, bm)
+
+    def search_fen(self, engine, tb, fen, bm):
+        start = time()
+        collector = InfoCollector(self, tb, fen, bm)
+        board = collector.board
+        if self.rawUci:
+            for line in engine.analysis(board, collector.limit, self.multiPV):
+                collector.add_raw(line)
+                if collector.stop:
+                    engine.stop()
+                    break
+        else:
+            with engine.analysis(
+                board, collector.limit, multipv=self.multiPV, game=board
+            ) as analysis:
+                for info in analysis:
+                    collector.add(info)
+                    if collector.stop:
+                        break  # leaving the context stops the search
+        self.lines += collector.lines
+        if self.record:
+            self.records.append((fen, bm, collector.recorded))
+        if profiler is not None:
+            return profiler.position(start, collector)
+        return collector.result()
+
+    def replay_fens(self, records):
+        """Like analyze_fens, but from the (fen, bm, info lines) of --record."""
+        lines, cpu = self.lines, process_time()
+        tb = worker_tb if worker_anas else self.open_tb()
+        result_fens = []
+        for fen, bm, recorded in records:
+            if recorded is None:
+                result_fens.append((fen, bm, None, 0, 0, 0, 0, {}, []))
+                continue
+            start = time()
+            collector = InfoCollector(self, tb, fen, bm)
+            for line in recorded:
+                collector.add_raw(line)
+            self.lines += collector.lines
+            if profiler is not None:
+                result_fens.append(profiler.position(start, collector))
+            else:
+                result_fens.append(collector.result())
+        stats = Counter(
+            {"Info lines": self.lines - lines, "CPU time": process_time() - cpu}
+        )
+        return result_fens, stats
+
+    async def open_engine_async(self):
+        with span("engine start"):
+            transport, engine = await asyncio.wait_for(
+                chess.engine.popen_uci(self.engine), self.timeout
+            )
+        with span("engine configure"):
+            await engine.configure(self.engine_options())
+        return transport, engine
+
+    async def analyze_fen_async(self, engine, tb, fen, bm, tid=0):
+        start = time()
+        collector = InfoCollector(self, tb, fen, bm)
+        board = collector.board
+        analysis = await engine.analysis(
+            board, collector.limit, multipv=self.multiPV, game=board
+        )
+        try:
+            with analysis:
+                async for info in analysis:
+                    collector.add(info)
+                    if collector.stop:
+                        break  # leaving the context stops the search
+        except BaseException:
+            # the engine is closed after a crash or timeout, which fails the
+            # search, so retrieve that outcome to avoid asyncio's warnings
+            task = asyncio.ensure_future(analysis.wait())
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            raise
+        self.lines += collector.lines
+        if self.record:
+            self.records.append((fen, bm, collector.recorded))
+        if profiler is not None:
+            return profiler.position(start, collector, tid)
+        return collector.result()
+
+    async def analyze_fens_async(self, fens, engines, callback):
+        """Analyse fens with several engines driven from a single event loop,
+        and pass the result of each position to callback(results, stats)."""
+        cpu = process_time()
+        tb = self.open_tb()  # probing does not yield, so the engines share it
+        fens = iter(fens)  # shared by all the engines
+
+        async def run(tid):
+            transport, engine = await self.open_engine_async()
+            for fen, bm in fens:
+                for attempt in range(self.retries + 1):
+                    try:
+                        result = await asyncio.wait_for(
+                            self.analyze_fen_async(engine, tb, fen, bm, tid),
+                            self.positionTimeout,
+                        )
+                        break
+                    except ENGINE_FAILURES as ex:
+                        if isinstance(ex, asyncio.TimeoutError):
+                            ex = self.timeout_error()  # raised by wait_for
+                        warn_restart(fen, ex)
+                        transport.close()
+                        transport, engine = await self.open_engine_async()
+                else:
+                    result = fen, bm, None, 0, 0, 0, 0, {}, []  # a crashed position
+                    if self.record:
+                        self.records.append((fen, bm, None))
+                records, self.records = self.records, []
+                callback([result], Counter(), 0, None, records)
+            await engine.quit()
+
+        await asyncio.gather(*(run(tid) for tid in range(engines)))
+        stats = Counter({"Info lines": self.lines, "CPU time": process_time() - cpu})
+        if tb is not None:
+            stats["TB cache hits"], stats["TB cache misses"] = tb.hits, tb.misses
+        callback([], stats)
+
+    def analyze_fens(self, fens):
+        result_fens = []
+        lines, cpu = self.lines, process_time()
+        if worker_error is not None:
+            raise worker_error
+        # inside a pool worker reuse its engines and TB, otherwise open new ones
+        if worker_anas:
+            engine, tb = self.worker_engine(), worker_tb
+        else:
+            engine, tb = self.open_engine(), self.open_tb()
+        if tb is not None:
+            tb.hits = tb.misses = 0
+        for fen, bm in fens:
+            for attempt in range(self.retries + 1):
+                try:
+                    result = self.analyze_fen(engine, tb, fen, bm)
+                    break
+                except ENGINE_FAILURES as ex:
+                    warn_restart(fen, ex)
+                    restart = worker_engines.get(self.engine) is engine
+                    try:
+                        engine.close()
+                    except Exception:
+                        pass  # the engine process may be gone already
+                    engine = self.open_engine()
+                    if restart:
+                        worker_engines[self.engine] = engine
+            else:
+                result = fen, bm, None, 0, 0, 0, 0, {}, []  # a crashed position
+                if self.record:
+                    self.records.append((fen, bm, None))
+            result_fens.append(result)
+
+        if worker_engines.get(self.engine) is not engine:
+            engine.quit()
+
+        # worker statistics for this batch, used with --bench
+        stats = Counter(
+            {"Info lines": self.lines - lines, "CPU time": process_time() - cpu}
+        )
+        if worker_name is not None:
+            stats["Worker nodes", worker_name] = sum(r[5] for r in result_fens)
+            stats["Worker time", worker_name] = sum(r[6] for r in result_fens)
+        if tb is not None:
+            stats["TB cache hits"], stats["TB cache misses"] = tb.hits, tb.misses
+
+        return result_fens, stats
+
+
+def parse_cpulist(txt):
+    """Return the CPUs of a Linux cpulist like 0-3,8-11 as a list."""
+    cpus = []
+    for part in txt.strip().split(","):
+        if part:
+            first, _, last = part.partition("-")
+            cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def cpu_topology():
+    """Return the usable CPUs as (node, sibling, core, cpu) tuples, where
+    sibling numbers the SMT threads of a core. Without sysfs every CPU is its
+    own core on node 0."""
+    sysfs = "/sys/devices/system"
+    nodes = {}
+    for name in os.listdir(f"{sysfs}/node") if os.path.isdir(f"{sysfs}/node") else []:
+        if re.fullmatch(r"node\d+", name):
+            with open(f"{sysfs}/node/{name}/cpulist") as f:
+                for cpu in parse_cpulist(f.read()):
+                    nodes[cpu] = int(name[4:])
+    topology = []
+    for cpu in sorted(os.sched_getaffinity(0)):
+        try:
+            with open(f"{sysfs}/cpu/cpu{cpu}/topology/thread_siblings_list") as f:
+                siblings = parse_cpulist(f.read())
+        except OSError:
+            siblings = [cpu]
+        core = (nodes.get(cpu, 0), min(siblings))
+        topology.append((nodes.get(cpu, 0), siblings.index(cpu), core, cpu))
+    return sorted(topology)
+
+
+def cpu_layout(workers, threads, noSMT=False):
+    """Return a disjoint list of CPUs for each worker, on a single NUMA node
+    where possible, and spread over the nodes. SMT siblings are only used
+    once all cores are taken, and never with noSMT."""
+    free = {}  # node -> CPUs, first sibling of all cores first
+    for node, sibling, _, cpu in cpu_topology():
+        if sibling == 0 or not noSMT:
+            free.setdefault(node, []).append(cpu)
+    chunks, spill = {}, []
+    for node, cpus in free.items():
+        n = len(cpus) // threads * threads
+        chunks[node] = [cpus[i : i + threads] for i in range(0, n, threads)]
+        spill += cpus[n:]
+    # alternate between the nodes, and let the left overs span nodes
+    layout = [c for group in zip_longest(*chunks.values()) for c in group if c]
+    layout += [spill[i : i + threads] for i in range(0, len(spill), threads)]
+    layout = [c for c in layout if len(c) == threads]
+    assert (
+        len(layout) >= workers
+    ), f"Cannot pin {workers} engine(s) with {threads} thread(s) each to {sum(map(len, free.values()))} CPUs."
+    return layout[:workers]
+
+
+worker_anas = []  # the Analysers passed to the pool initializer, one per variant
+worker_engines = {}  # engine command -> the engine owned by the current pool worker
+worker_options = {}  # engine command -> the options it was last configured with
+worker_tb = None  # the worker's own EGTB handle for checking TB win PVs
+worker_error = None  # exception raised while starting the worker's engine
+worker_suite = None  # the memory-mapped compiled suite, if batches are indices
+worker_name = None  # the worker's label in the --bench statistics
+
+
+def init_worker(anas, cpus=None):
+    # start the worker's engine once, and quit it when the worker exits cleanly
+    global worker_anas, worker_tb, worker_error, worker_suite, worker_name, profiler
+    worker_anas = anas
+    worker_name = f"pid {os.getpid()}"
+    if cpus is not None:
+        try:
+            cpuset = cpus.get_nowait()  # the engine inherits the affinity
+            os.sched_setaffinity(0, cpuset)
+            worker_name = f"CPUs {','.join(map(str, cpuset))}"
+        except queue.Empty:
+            pass  # a restarted worker is not pinned
+    ana = anas[0]
+    if ana.profile:
+        profiler = Profiler(ana.trace, f"worker {worker_name}")
+    if ana.suite is not None:
+        worker_suite = Suite(ana.suite)
+    try:
+        worker_tb = ana.open_tb()
+        if not ana.replay:
+            ana.worker_engine()
+    except Exception as ex:
+        # a failing pool initializer is silently restarted, so defer the error
+        worker_error = ex
+        return
+    util.Finalize(None, quit_engines, exitpriority=10)
+
+
+def quit_engines():
+    # engines may be restarted or opened later, so look them up on exit
+    for engine in worker_engines.values():
+        engine.quit()
+
+
+def analyze_batch(batch):
+    # the Analysers are sent once per worker, as they may hold the multipv_fens
+    variant, fens = batch
+    if worker_suite is not None:  # fens are given as record numbers
+        fens = [worker_suite[i][:2] for i in fens]
+    ana = worker_anas[variant]
+    result = ana.replay_fens(fens) if ana.replay else ana.analyze_fens(fens)
+    trace = profiler.flush() if profiler is not None else None
+    records, ana.records = ana.records, []
+    return result + (variant, trace, records)
+
+
+def pin_workers(args, workers):
+    """Print the CPU layout for --pin, and return a queue from which each
+    worker takes its CPUs, or None."""
+    if not (args.pin or args.pinNoSMT):
+        return None
+    layout = cpu_layout(workers, args.threads or 1, args.pinNoSMT)
+    nodes = {cpu: node for node, _, _, cpu in cpu_topology()}
+    print(f"Pinning {workers} engine(s) to CPUs:")
+    cpus = Queue()
+    for i, cpuset in enumerate(layout):
+        on = sorted({nodes[cpu] for cpu in cpuset})
+        print(
+            f"{i:>4}: CPUs {','.join(map(str, cpuset))} on NUMA node {','.join(map(str, on))}"
+        )
+        cpus.put(cpuset)
+    return cpus
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "localhost", int(port)
+
+
+def run_worker(address, authkey, cpus=None):
+    """Analyse the batches sent by a coordinator started with --serve."""
+    with Client(address, authkey=authkey) as conn:
+        init_worker(conn.recv(), cpus)
+        while True:
+            try:
+                batch = conn.recv()
+            except EOFError:
+                break  # the coordinator has finished
+            if batch is None:
+                break
+            try:
+                result = analyze_batch(batch)
+            except Exception as ex:
+                result = ex  # passed on to the coordinator, as with Pool
+            conn.send(result)
+
+
+def serve(anas, fensbatched, address, authkey, callback):
+    """Hand out the batches to the workers that connect to address, and pass
+    their results to callback(results, stats, variant). The batch of a worker that
+    disconnects is handed out again."""
+    todo, left = deque(fensbatched), len(fensbatched)
+    done = queue.Queue()
+    cond = threading.Condition()
+
+    def handle(conn):
+        nonlocal left
+        with conn:
+            try:
+                conn.send(anas)
+            except OSError:
+                return
+            while True:
+                with cond:
+                    cond.wait_for(lambda: todo or not left)
+                    batch = todo.popleft() if todo else None
+                if batch is None:
+                    try:
+                        conn.send(None)
+                    except OSError:
+                        pass
+                    return
+                try:
+                    conn.send(batch)
+                    result = conn.recv()
+                except (EOFError, OSError):
+                    tqdm.write("Worker disconnected, its batch is queued again.")
+                    with cond:
+                        todo.appendleft(batch)
+                        cond.notify_all()
+                    return
+                with cond:
+                    left -= 1
+                    cond.notify_all()
+                done.put(result)
+
+    def accept(listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                return  # the listener was closed
+            except Exception:
+                continue  # e.g. a failed authentication
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    listener = Listener(address, backlog=64, authkey=authkey)
+    print(f"Serving on {address[0]}:{address[1]}, waiting for workers ...")
+    threading.Thread(target=accept, args=(listener,), daemon=True).start()
+    try:
+        for _ in fensbatched:
+            result = done.get()
+            if isinstance(result, Exception):
+                raise result
+            callback(*result)
+    finally:
+        listener.close()
+
+
+def abort(ex):
+    print(
+        f"\nFATAL ERROR: Engine or worker crashed ({type(ex).__name__}: {ex}). Terminating immediately.",
+        file=sys.stderr,
+    )
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if sys.platform != "win32":
+        os.killpg(os.getpgrp(), signal.SIGKILL)
+    else:
+        for child in active_children():
+            child.kill()  # Forcefully kill the running worker processes
+        os._exit(1)
+
+
+def result_to_list(result):
+    fen, bm, pvstatus, nodes, depth, lastnodes, lasttime, dropped, curve = result
+    lines = [
+        [multipv, m, score, pv if pv == "bound" else list(pv), status, last_line]
+        for (multipv, m, score, pv), (status, last_line) in pvstatus.items()
+    ]
+    curve = [[b, result_to_list(r)] for b, r in curve]
+    return [fen, bm, lines, nodes, depth, lastnodes, lasttime, dropped, curve]
+
+
+def list_to_result(lst):
+    fen, bm, lines, nodes, depth, lastnodes, lasttime, dropped, curve = lst
+    pvstatus = {
+        (multipv, m, score, pv if pv == "bound" else tuple(pv)): (status, last_line)
+        for multipv, m, score, pv, status, last_line in lines
+    }
+    curve = [(b, list_to_result(r)) for b, r in curve]
+    return fen, bm, pvstatus, nodes, depth, lastnodes, lasttime, dropped, curve
+
+
+def encode_result(result):
+    """Serialize a result tuple from analyze_fens to a JSON string."""
+    return json.dumps(result_to_list(result))
+
+
+def decode_result(txt):
+    """Inverse of encode_result."""
+    return list_to_result(json.loads(txt))
+
+
+def rss(pid="self"):
+    """Return the resident memory of a process in MB, from /proc."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+def parse_memory(txt):
+    """Return a memory size like 500M, 64G or auto, i.e. the memory that is
+    available now, in MB."""
+    if txt == "auto":
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+        raise ValueError("MemAvailable not found in /proc/meminfo")
+    units = {"K": 1 / 1024, "M": 1, "G": 1024, "T": 1024**2}
+    if txt[-1:].upper() in units:
+        return float(txt[:-1]) * units[txt[-1].upper()]
+    return float(txt)
+
+
+def file_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def run_config(args, ana, name):
+    """Return a hash of all the settings that determine a position's result."""
+    config = {
+        "engine": file_hash(shutil.which(args.engine) or args.engine),
+        "name": name,
+        "limit": {
+            k: v for k, v in dataclasses.asdict(ana.limit).items() if v is not None
+        },
+        "mate": args.mate,
+        "hash": args.hash,
+        "threads": args.threads,
+        "multiPV": args.multiPV,
+        "evalFile": file_hash(args.evalFile) if args.evalFile else None,
+        "syzygyPath": args.syzygyPath,
+        "syzygy50MoveRule": args.syzygy50MoveRule,
+        "minTBscore": args.minTBscore,
+        "maxTBscore": args.maxTBscore,
+        "engineOpts": args.engineOpts,
+        "nodesCurve": args.nodesCurve,
+        "stopOnBestMate": args.stopOnBestMate,
+        "compact": args.compactResults
+        and [
+            args.showAllIssues,
+            args.maxValidMate,
+            args.minValidMate,
+            args.shortTBPVonly,
+            sorted(file_hash(f) for f in args.multipvFile or []),
+        ],
+    }
+    txt = json.dumps(config, sort_keys=True)
+    return hashlib.sha256(txt.encode()).hexdigest()
+
+
+class ResultCache:
+    """SQLite store of analyze_fens results for one engine configuration."""
+
+    def __init__(self, filename, config):
+        self.config = config
+        self.db = sqlite3.connect(filename)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results (config TEXT, fen TEXT, bm INTEGER, result TEXT, PRIMARY KEY (config, fen, bm))"
+        )
+
+    def get(self, fens):
+        # bm is stored as 0 if not known, as NULL is not unique in SQLite
+        rows = self.db.execute(
+            "SELECT fen, bm, result FROM results WHERE config = ?", (self.config,)
+        )
+        cached = {(fen, bm): result for fen, bm, result in rows}
+        return {
+            (fen, bm): decode_result(cached[fen, bm or 0])
+            for fen, bm in fens
+            if (fen, bm or 0) in cached
+        }
+
+    def put(self, results):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+            [(self.config, r[0], r[1] or 0, encode_result(r)) for r in results],
+        )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class Journal:
+    """Append-only file with the results of completed positions of a run."""
+
+    def __init__(self, filename, config, resume=False):
+        self.results = {}
+        header = json.dumps({"config": config}) + "\n"
+        if not (resume and os.path.exists(filename)):
+            self.file = open(filename, "w")
+            self.file.write(header)
+            self.sync()
+            return
+        with open(filename, "rb") as f:
+            lines = f.read().split(b"\n")
+        assert (
+            lines[0].decode() + "\n" == header
+        ), f"Journal {filename} was written for a different configuration."
+        size = len(lines[0]) + 1
+        for line in lines[1:-1]:  # the last line is incomplete after a crash
+            try:
+                result = decode_result(line)
+            except ValueError:
+                break
+            self.results[result[0], result[1]] = result
+            size += len(line) + 1
+        self.file = open(filename, "a")
+        self.file.truncate(size)  # drop any partially written result
 
-    def analyze_fens(self, fens):
-        result_fens = []
-        engine = chess.engine.SimpleEngine.popen_uci(self.engine, timeout=self.timeout)
-        if self.threads is not None:
-            engine.configure({"Threads": self.threads})
-        if self.hash is not None:
-            engine.configure({"Hash": self.hash})
-        if self.evalFile is not None:
-            engine.configure({"EvalFile": self.evalFile})
-        if self.syzygyPath is not None:
-            engine.configure({"SyzygyPath": self.syzygyPath})
-        if self.syzygy50MoveRule is not None:
-            engine.configure({"Syzygy50MoveRule": self.syzygy50MoveRule})
-        if self.engineOpts is not None:
-            engine.configure(self.engineOpts)
-        for fen, bm in fens:
-            board = chess.Board(fen)
-            pvstatus = {}  #  stores (status, final_line)
-            m, score, pv = None, None, ()
-            nodes = depth = lastnodes = lasttime = 0
-            if self.mate is not None and self.mate == 0 and bm:
-                limit = chess.engine.Limit(
-                    nodes=self.nodes, depth=self.depth, time=self.time, mate=abs(bm)
-                )
+    def put(self, results):
+        for result in results:
+            self.file.write(encode_result(result) + "\n")
+        self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class Recording:
+    """Gzip compressed file with the info lines of all the positions of a run,
+    that --replay analyses again. A json header with the settings of the run
+    is followed by a json list [fen, bm, info lines or null] per position."""
+
+    # the settings that determine the info lines, taken from the recording
+    ARGS = ["engine", "nodes", "depth", "time", "timeinc", "mate", "hash"]
+    ARGS += ["threads", "multiPV", "evalFile", "engineOpts", "stopOnBestMate"]
+
+    def __init__(self, filename, args, name, msg):
+        self.file = gzip.open(filename, "wt", compresslevel=6)
+        settings = {key: getattr(args, key) for key in self.ARGS}
+        header = {"name": name, "msg": msg, "args": settings}
+        self.file.write(json.dumps(header) + "\n")
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def read(filename):
+        """Return the header and the list of (fen, bm, info lines) records."""
+        with gzip.open(filename, "rt") as f:
+            header = json.loads(f.readline())
+            return header, [tuple(json.loads(line)) for line in f]
+
+
+class Suite:
+    """A compiled suite, as written by compile_suite, that is memory-mapped.
+    After a header follow fixed size records of (bm, offset and length of the
+    FEN, offset and length of the PV), and then the strings."""
+
+    MAGIC = b"MTSUITE\0"
+    VERSION = 2
+    HEADER = struct.Struct("<8sII")  # magic, version, number of records
+    RECORD = struct.Struct("<iIIII")
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = self.HEADER.unpack_from(self.mm)
+        assert (
+            magic == self.MAGIC and version == self.VERSION
+        ), f"{filename} is not a compiled suite of version {self.VERSION}, compile it again."
+
+    @classmethod
+    def is_suite(cls, filename):
+        with open(filename, "rb") as f:
+            return f.read(len(cls.MAGIC)) == cls.MAGIC
+
+    def __len__(self):
+        return self.count
+
+    def record(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.RECORD.unpack_from(self.mm, self.HEADER.size + i * self.RECORD.size)
+
+    def __getitem__(self, i):
+        bm, fen_start, fen_len, pv_start, pv_len = self.record(i)
+        fen = self.mm[fen_start : fen_start + fen_len].decode()
+        pv = self.mm[pv_start : pv_start + pv_len].decode().split()
+        return fen, bm if bm else None, pv
+
+
+def normalize_fen(fen):
+    """Return fen as written by python-chess, with move counters only if fen
+    has them, as the halfmove clock matters for the 50-move rule."""
+    board = chess.Board(fen)
+    return board.fen() if len(fen.split()) > 4 else board.epd()
+
+
+def compile_suite(filenames, outFile):
+    """Write the positions in filenames to a compiled suite, with normalized
+    FENs that are deduplicated like load_bmfens does, in file order."""
+    records = {}  # fen -> (bm, pv)
+    for epd in filenames:
+        for fen, bm, pv in read_epd(epd):
+            fen = normalize_fen(fen)
+            if fen in records:
+                bmold, _ = records[fen]
+                if bm != bmold:
+                    print(
+                        f'Warning: For duplicate FEN "{fen}" we only keep faster mate between #{bm} and #{bmold}.'
+                    )
+                    if bm and (bmold is None or abs(bm) < abs(bmold)):
+                        records[fen] = bm, pv
             else:
-                limit = self.limit
-            lastkey = None
-            with engine.analysis(
-                board, limit, multipv=self.multiPV, game=board
-            ) as analysis:
-                for info in analysis:
-                    lastnodes = info.get("nodes", lastnodes)
-                    lasttime = info.get("time", lasttime)
-                    if "score" in info:
-                        multipv = info.get("multipv", 1)
-                        temp_score = info["score"].pov(board.turn)
-                        temp_m = temp_score.mate()
-                        if multipv == 1:
-                            lastkey = None
-                        if "upperbound" in info or "lowerbound" in info:
-                            if temp_m:
-                                pvstatus[multipv, temp_m, None, "bound"] = "", False
-                            continue
-                        m, score = temp_m, temp_score.score()
-                        if m is None and (
-                            self.syzygyPath is None
-                            or score is None
-                            or abs(score) < self.minTBscore
-                        ):
-                            continue
-                        pv = tuple(m.uci() for m in info["pv"]) if "pv" in info else ()
-                        if (multipv, m, score, pv) not in pvstatus:
-                            pvstatus[multipv, m, score, pv] = (
-                                pv_status(fen, m, score, pv) if m else "None",
-                                False,
-                            )
-                        if multipv == 1:
-                            nodes = lastnodes
-                            depth = info.get("depth", 0)
-                            lastkey = 1, m, score, pv
-            if lastkey in pvstatus:  # mark final info line for best move
-                pvstatus[lastkey] = pvstatus[lastkey][0], True
-            result_fens.append((fen, bm, pvstatus, nodes, depth, lastnodes, lasttime))
+                records[fen] = bm, pv
 
-        engine.quit()
+    offset = Suite.HEADER.size + len(records) * Suite.RECORD.size
+    index, strings = [], []
+    for fen, (bm, pv) in records.items():
+        fen, pv = fen.encode(), " ".join(pv).encode()
+        index.append(
+            Suite.RECORD.pack(bm or 0, offset, len(fen), offset + len(fen), len(pv))
+        )
+        strings += [fen, pv]
+        offset += len(fen) + len(pv)
+    with open(outFile, "wb") as f:
+        f.write(Suite.HEADER.pack(Suite.MAGIC, Suite.VERSION, len(records)))
+        f.write(b"".join(index))
+        f.write(b"".join(strings))
+    return len(records)
 
-        return result_fens
+
+def load_grid(spec):
+    """Return the list of option sets in spec, a file or a json string. It is
+    either a list of dictionaries, one dictionary per line, or a dictionary of
+    lists of values, whose Cartesian product is taken."""
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            spec = f.read()
+    try:
+        grid = json.loads(spec)
+    except json.JSONDecodeError:  # one dictionary per line
+        grid = [json.loads(line) for line in spec.splitlines() if line.strip()]
+    if isinstance(grid, dict):
+        values = [v if isinstance(v, list) else [v] for v in grid.values()]
+        grid = [dict(zip(grid, v)) for v in product(*values)]
+    return grid
 
 
-def load_bmfens(filenames, unlimited=False, mateLimit=None, bmMin=None, bmMax=None):
+def read_epd(filename):
+    """Yield (fen, bm, pv) for the positions in an .epd file or a compiled suite."""
+    if Suite.is_suite(filename):
+        yield from Suite(filename)
+        return
     p = re.compile(
         r"^([1-8a-zA-Z/]+ [wb] [a-zA-Z\-]+ [a-h1-8\-]+(?: \d+ \d+)?)( bm #(-?\d+);)?"
     )
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):  # ignore empty lines and comments
+                continue
+            m = p.match(line)
+            if not m:
+                print("---------------------> IGNORING : ", line)
+                continue
+            bm = int(m.group(3)) if m.group(2) is not None else None
+            _, _, pv = line.partition("; PV: ")
+            yield m.group(1), bm, pv.partition(";")[0].split()
+
+
+def load_bmfens(
+    filenames, unlimited=False, mateLimit=None, bmMin=None, bmMax=None, indices=None
+):
+    """Return a dictionary fen -> bm. For a single compiled suite, the dict
+    indices, if given, receives each FEN's record number."""
     bmfens = {}
     for epd in filenames:
-        with open(epd) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):  # ignore empty lines and comments
-                    continue
-                m = p.match(line)
-                if not m:
-                    print("---------------------> IGNORING : ", line)
-                    continue
-                fen = m.group(1)
-                bm = int(m.group(3)) if m.group(2) is not None else None
-                if unlimited and (bm is None or mateLimit < abs(bm)):
-                    continue  # avoid analyses that cannot terminate
-                if (bmMin is not None and (bm is None or abs(bm) < bmMin)) or (
-                    bmMax is not None and (bm is None or abs(bm) > bmMax)
-                ):
-                    continue
-                if fen in bmfens:
-                    bmold = bmfens[fen]
-                    if bm != bmold:
-                        print(
-                            f'Warning: For duplicate FEN "{fen}" we only keep faster mate between #{bm} and #{bmold}.'
-                        )
-                        if bm and (bmold is None or abs(bm) < abs(bmold)):
-                            bmfens[fen] = bm
-                else:
-                    bmfens[fen] = bm
+        for i, (fen, bm, _) in enumerate(read_epd(epd)):
+            if unlimited and (bm is None or mateLimit < abs(bm)):
+                continue  # avoid analyses that cannot terminate
+            if (bmMin is not None and (bm is None or abs(bm) < bmMin)) or (
+                bmMax is not None and (bm is None or abs(bm) > bmMax)
+            ):
+                continue
+            if fen in bmfens:
+                bmold = bmfens[fen]
+                if bm != bmold:
+                    print(
+                        f'Warning: For duplicate FEN "{fen}" we only keep faster mate between #{bm} and #{bmold}.'
+                    )
+                    if bm and (bmold is None or abs(bm) < abs(bmold)):
+                        bmfens[fen] = bm
+            else:
+                bmfens[fen] = bm
+                if indices is not None:
+                    indices[fen] = i
     return bmfens
 
 
 if __name__ == "__main__":
     freeze_support()
+    if sys.argv[1:2] == ["compile"]:
+        parser = argparse.ArgumentParser(
+            prog="matecheck.py compile",
+            description="Compile .epd files into a deduplicated binary suite, that can be passed to --epdFile and --multipvFile for faster loading.",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        )
+        parser.add_argument(
+            "--epdFile",
+            nargs="+",
+            default=["matetrack.epd"],
+            help="file(s) containing the positions, their mate scores and possibly their PVs",
+        )
+        parser.add_argument(
+            "--outFile",
+            default="matetrack.mts",
+            help="output file for the compiled suite",
+        )
+        args = parser.parse_args(sys.argv[2:])
+        count = compile_suite(args.epdFile, args.outFile)
+        print(f"Wrote {count} positions to {args.outFile}.")
+        sys.exit(0)
+
     parser = argparse.ArgumentParser(
         description='Check how many (best) mates an engine finds in e.g. matetrack.epd, a file with lines of the form "FEN bm #X;".',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -248,7 +1927,7 @@ if __name__ == "__main__":
         "--epdFile",
         nargs="+",
         default=["matetrack.epd"],
-        help="file(s) containing the positions and their mate scores",
+        help="file(s) containing the positions and their mate scores, or compiled suites",
     )
     parser.add_argument(
         "--engine",
@@ -265,6 +1944,17 @@ if __name__ == "__main__":
         type=str,
         help="nodes limit per position, default: 10**6 without other limits, otherwise None",
     )
+    parser.add_argument(
+        "--nodesCurve",
+        type=lambda s: sorted(int(float(n)) for n in s.split(",")),
+        default=[],
+        help="comma separated nodes limits, e.g. 1e4,1e5,1e6: search with the largest, and also report approximate results for the smaller ones, as derived from the engine's UCI output of that search",
+    )
+    parser.add_argument(
+        "--stopOnBestMate",
+        action="store_true",
+        help="stop the search of a position as soon as the best mate is found with a valid PV, for quick sanity checks (not comparable to the results of full searches)",
+    )
     parser.add_argument("--depth", type=int, help="depth limit per position")
     parser.add_argument(
         "--time", type=float, help="time limit (in seconds) per position"
@@ -299,6 +1989,12 @@ if __name__ == "__main__":
         "--syzygyPath",
         help="path(s) to syzygy EGTBs, with ':'/';' as separator on Linux/Windows",
     )
+    parser.add_argument(
+        "--tbCacheSize",
+        type=int,
+        default=10**5,
+        help="maximal number of EGTB probe results each worker keeps in its LRU cache for checking TB win PVs",
+    )
     parser.add_argument(
         "--evalFile",
         help="path for the EvalFile to be used with the engine if the default net is not to be used",
@@ -337,11 +2033,117 @@ if __name__ == "__main__":
         default=cpu_count(),
         help="total number of threads script may use, default: cpu_count()",
     )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="number of times a position is searched again with a restarted engine, after the engine crashed or failed on it",
+    )
+    parser.add_argument(
+        "--positionTimeout",
+        type=float,
+        help="seconds after which the search of a single position counts as hung, and the engine is restarted as after a crash, default: no limit",
+    )
+    parser.add_argument(
+        "--driver",
+        choices=["pool", "async"],
+        default="pool",
+        help="run each engine from its own worker process, or all engines from a single asyncio event loop in the main process",
+    )
+    parser.add_argument(
+        "--memoryBudget",
+        type=parse_memory,
+        help="memory the run may use, e.g. 64G or auto for the memory available now: hash, engine and Python memory are measured or estimated per engine worker, and fewer workers are used if needed",
+    )
+    parser.add_argument(
+        "--record",
+        help="store the relevant UCI info lines of all positions in this compressed file, to analyse them again with --replay",
+    )
+    parser.add_argument(
+        "--replay",
+        help="analyse the info lines stored with --record again, e.g. with other validation settings, without starting an engine (the search settings of the recorded run are used)",
+    )
+    parser.add_argument(
+        "--profileTrace",
+        help="write the time spent in each phase, per process and per position, in the Chrome trace event format to this file, e.g. for chrome://tracing or ui.perfetto.dev",
+    )
+    parser.add_argument(
+        "--pin",
+        action="store_true",
+        help="pin each engine to its own CPUs, one NUMA node per engine where possible, using SMT siblings only when all cores are taken (not with --driver async)",
+    )
+    parser.add_argument(
+        "--pinNoSMT",
+        action="store_true",
+        help="like --pin, but never use SMT siblings",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="[HOST:]PORT",
+        help="coordinate the run and hand out the positions to workers started with --connect on this or other hosts, instead of running the engines locally (CONCURRENCY is then used as the expected total number of engines)",
+    )
+    parser.add_argument(
+        "--connect",
+        metavar="HOST:PORT",
+        help="run CONCURRENCY // THREADS engines as workers for the coordinator at HOST:PORT, which provides all the other settings",
+    )
+    parser.add_argument(
+        "--authKey",
+        help="shared secret that workers use to authenticate with the coordinator, which generates and prints a random one if none is given",
+    )
+    parser.add_argument(
+        "--rawUci",
+        action="store_true",
+        help="read the engine's UCI output with a minimal built-in client, that only fully parses info lines with a score, instead of python-chess (not with --driver async)",
+    )
+    parser.add_argument(
+        "--engine2",
+        help="compare with this engine: both engines search each position, and the run stops as soon as a sequential test on the positions where only one engine finds the best mate is decided, so engines that rarely disagree may search all positions without a result (only with --driver pool)",
+    )
+    parser.add_argument(
+        "--sprtAlpha",
+        type=float,
+        default=0.05,
+        help="with --engine2, probability to wrongly find a difference in the best mates found",
+    )
+    parser.add_argument(
+        "--sprtBeta",
+        type=float,
+        default=0.05,
+        help="with --engine2, probability to miss a difference of SPRTDELTA",
+    )
+    parser.add_argument(
+        "--sprtDelta",
+        type=float,
+        default=0.2,
+        help="with --engine2, difference to detect in the chance that a position where only one engine finds the best mate is one of B's, i.e. 1/2 +- SPRTDELTA",
+    )
     parser.add_argument(
         "--engineOpts",
         type=json.loads,
         help="json encoded dictionary of generic options, e.g. tuning parameters, to be used to initialize the engine",
     )
+    parser.add_argument(
+        "--engineOptsGrid",
+        type=load_grid,
+        help="file or json string with option sets that are added to ENGINEOPTS, all positions are searched with each set and the results compared: a list of dictionaries, one dictionary per line, or a dictionary of lists of values whose combinations form the sets",
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        help="search only a sample of this many positions, stratified by |bm|, and estimate the results for all positions",
+    )
+    parser.add_argument(
+        "--sampleSeed",
+        type=int,
+        default=1,
+        help="seed for --sample, the same seed always gives the same sample",
+    )
+    parser.add_argument(
+        "--sampleByPieces",
+        action="store_true",
+        help="with --sample, also stratify by the number of pieces, in steps of 8",
+    )
     parser.add_argument(
         "--bmMin",
         type=int,
@@ -357,6 +2159,11 @@ if __name__ == "__main__":
         action="store_true",
         help="show all unique UCI info lines with an issue, by default show for each FEN only the first occurrence of each possible type of issue",
     )
+    parser.add_argument(
+        "--compactResults",
+        action="store_true",
+        help="let the workers only return the UCI info lines needed for the final report, to save memory with long searches and --multiPV",
+    )
     parser.add_argument(
         "--shortTBPVonly",
         action="store_true",
@@ -376,6 +2183,23 @@ if __name__ == "__main__":
         "--logFile",
         help="optional file to log the engine's output while it is analysing",
     )
+    parser.add_argument(
+        "--cacheFile",
+        help="optional SQLite file to reuse results from previous runs with the same engine and options (ignored for --threads > 1 and --time)",
+    )
+    parser.add_argument(
+        "--journalFile",
+        help="optional file to journal the results of completed positions to, so that an interrupted run can be continued with --resume",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the positions already stored in JOURNALFILE and include their results in the report",
+    )
+    parser.add_argument(
+        "--jsonlFile",
+        help="optional file to stream a JSON record to for each position as soon as its analysis is complete",
+    )
     parser.add_argument(
         "--foundMatesFile",
         help="optional file to save the positions the engine found a mate for",
@@ -385,6 +2209,12 @@ if __name__ == "__main__":
         help="optional file to save the positions the engine found no mate for",
     )
     args = parser.parse_args()
+    if args.nodesCurve:
+        assert (
+            args.nodes is None and args.time is None
+        ), "--nodesCurve cannot be combined with --nodes or --time."
+        args.nodes = str(args.nodesCurve[-1])
+        assert not args.stopOnBestMate, "--nodesCurve needs complete searches."
     if (
         args.nodes is None
         and args.depth is None
@@ -404,25 +2234,111 @@ if __name__ == "__main__":
         and args.depth is None
         and args.mate is None
     ), "--timeinc needs (only) --time."
+    assert not args.resume or args.journalFile, "--resume needs --journalFile."
+    assert (
+        not args.connect or args.authKey
+    ), "--connect needs the --authKey of the coordinator."
+    assert not (args.rawUci and args.driver == "async"), "--rawUci needs --driver pool."
+    assert not args.engine2 or (
+        args.driver == "pool" and not args.serve
+    ), "--engine2 needs --driver pool."
+    assert not args.engine2 or not (
+        args.journalFile or args.cacheFile
+    ), "--engine2 cannot be used with --journalFile or --cacheFile."
+    assert not (args.record and args.replay), "Use either --record or --replay."
+    assert not (args.record or args.replay) or not (
+        args.journalFile or args.cacheFile or args.serve or args.connect
+    ), "--record and --replay cannot be used with --journalFile, --cacheFile, --serve or --connect."
+    assert not (args.record or args.replay) or not (
+        args.engine2 or args.engineOptsGrid
+    ), "--record and --replay cannot be used with --engine2 or --engineOptsGrid."
+    assert not (
+        args.replay and args.memoryBudget
+    ), "--replay cannot be used with --memoryBudget."
+    assert not args.memoryBudget or not (
+        args.serve or args.connect
+    ), "--memoryBudget cannot be used with --serve or --connect."
+    assert not (args.pin or args.pinNoSMT) or (
+        args.driver == "pool" and not args.serve
+    ), "--pin needs --driver pool, and pins the engines of --connect."
+    assert not (
+        args.engine2 and args.engineOptsGrid
+    ), "Use either --engine2 or --engineOptsGrid."
+    assert not args.engineOptsGrid or (
+        args.driver == "pool"
+    ), "--engineOptsGrid needs --driver pool."
+    assert not args.engineOptsGrid or not (
+        args.journalFile or args.cacheFile
+    ), "--engineOptsGrid cannot be used with --journalFile or --cacheFile."
 
     if args.logFile:
         print(f"Logging of engine output to {args.logFile} enabled.")
         logging.basicConfig(filename=args.logFile, level=logging.DEBUG)
 
+    if args.connect:
+        # the coordinator sends the Analyser, so only the local engine count matters
+        workers = args.concurrency // (args.threads if args.threads else 1)
+        address = parse_address(args.connect)
+        print(f"Connecting {workers} engine(s) to {address[0]}:{address[1]} ...")
+        cpus = pin_workers(args, max(1, workers))
+        processes = [
+            Process(target=run_worker, args=(address, args.authKey.encode(), cpus))
+            for _ in range(max(1, workers))
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        sys.exit(0)
+
+    recording = None
+    if args.replay:
+        header, recording = Recording.read(args.replay)
+        assert (
+            not args.nodesCurve or args.nodesCurve[-1] == header["args"]["nodes"]
+        ), "The largest --nodesCurve value must be the recorded nodes limit."
+        vars(args).update(header["args"])
     ana = Analyser(args)
+    if ana.profile:
+        profiler = Profiler(ana.trace, "matecheck.py")
     unlimited = (
         args.mate and args.nodes is None and args.depth is None and args.time is None
     )
 
-    bmfens = load_bmfens(args.epdFile, unlimited, args.mate, args.bmMin, args.bmMax)
+    # for a single compiled suite, pool workers can read the FENs themselves
+    indices = None
+    if recording is not None:
+        pass  # the positions are those of the recording
+    elif len(args.epdFile) == 1 and Suite.is_suite(args.epdFile[0]):
+        indices = {}
+        if args.driver == "pool" and not args.serve:
+            ana.suite = args.epdFile[0]
+    with span("load"):
+        if recording is not None:
+            bmfens = {fen: bm for fen, bm, _ in recording}
+            recording = {fen: lines for fen, _, lines in recording}
+        else:
+            bmfens = load_bmfens(
+                args.epdFile, unlimited, args.mate, args.bmMin, args.bmMax, indices
+            )
+
+    fens = list(bmfens.items())
+    strata = None
+    if args.sample is not None and args.sample < len(fens):
+        fens, strata = sample_fens(
+            fens, args.sample, args.sampleSeed, args.sampleByPieces
+        )
+        print(
+            f"Sampled {len(fens)} of {len(bmfens)} FENs from {len(strata)} strata with seed {args.sampleSeed}."
+        )
+    sample = list(fens)  # fens loses the journalled and cached positions
 
-    absbms = [abs(bm) for bm in bmfens.values() if bm is not None]
+    absbms = [abs(bm) for _, bm in fens if bm is not None]
     numbm = len(absbms)
     absbms = absbms if absbms else [0]
     maxbm = max(absbms)
-    fens = list(bmfens.items())
-    random.seed(42)
-    random.shuffle(fens)  # try to balance the analysis time across chunks
+    # longest expected first, so that the final batches are small and fast
+    fens.sort(key=lambda fen_bm: estimate_cost(*fen_bm), reverse=True)
 
     print(
         f"Loaded {len(fens)} FENs with {numbm} bm values, with |bm| (min avg max): {min(absbms)} {round(sum(absbms) / len(absbms))} {maxbm}."
@@ -438,16 +2354,22 @@ if __name__ == "__main__":
             f"Loaded {len(multipv_fens)} possible children FENs with {c} bm values for MultiPV checks."
         )
 
+    finder = IssueFinder(args, multipv_fens)
+    if args.compactResults:
+        ana.finder = finder
+
     numfen = len(fens)
     workers = args.concurrency // (args.threads if args.threads else 1)
     assert (
         workers > 0
     ), f"Need concurrency >= threads, but concurrency = {args.concurrency} and threads = {args.threads}."
-    fw_ratio = numfen // (4 * workers)
-    fenschunked = list(chunks(fens, max(1, fw_ratio)))
 
     if args.engineOpts is not None:
         print("Additional generic engine options: ", args.engineOpts)
+    if args.engineOptsGrid:
+        print(f"Engine option sets ({len(args.engineOptsGrid)}):")
+        for i, opts in enumerate(args.engineOptsGrid):
+            print(f"{i:>4}: {json.dumps(opts)}")
 
     options = [
         ("bmMin", args.bmMin),
@@ -471,210 +2393,250 @@ if __name__ == "__main__":
         + " with "
         + " ".join([f"--{k} {v}" for k, v in options if v is not None])
     )
+    if args.stopOnBestMate:
+        msg += " --stopOnBestMate"
 
-    print(f"\nMatetrack started for {msg} ...", flush=True)
-    engine = chess.engine.SimpleEngine.popen_uci(args.engine)
-    name = engine.id.get("name", "")
-    engine.quit()
+    tb = args.syzygyPath is not None  # TB win PVs are checked by the workers
+    if tb:
+        count = TB.tables(args.syzygyPath)
+        TB.complete(count)
+        print(f"Found {count} tablebases.")
 
-    res = []
-    futures = []
+    if recording is not None:
+        name, msg = header["name"], header["msg"] + f", replayed from {args.replay}"
+        print(f"\nMatetrack replay started for {msg} ...", flush=True)
+    else:
+        print(f"\nMatetrack started for {msg} ...", flush=True)
+        engine = chess.engine.SimpleEngine.popen_uci(args.engine)
+        name = engine.id.get("name", "")
+        nodefault = []
+        if args.engineOptsGrid:
+            # options missing from a set are reset to the engine's default
+            grid = [{**(args.engineOpts or {}), **o} for o in args.engineOptsGrid]
+            unset = set().union(*grid) - set.intersection(*map(set, grid))
+            nodefault = [
+                key
+                for key in sorted(unset)
+                if key in engine.options and engine.options[key].default is None
+            ]
+        engine.quit()
+        assert (
+            not nodefault
+        ), f"Options without a default must be in every set of --engineOptsGrid: {', '.join(nodefault)}."
+    recorder = Recording(args.record, args, name, msg) if args.record else None
 
-    with tqdm(total=len(fenschunked), smoothing=0, miniters=1) as pbar:
-        with Pool(processes=workers) as e:
-            try:
-                for future in e.imap_unordered(ana.analyze_fens, fenschunked):
-                    pbar.update(1)
-                    res += future
-            except chess.engine.EngineTerminatedError as ex:
-                print(
-                    f"\nFATAL ERROR: Engine or worker crashed ({type(ex).__name__}: {ex}). Terminating immediately.",
-                    file=sys.stderr,
-                )
-                sys.stdout.flush()
-                sys.stderr.flush()
-                e.terminate()
-                if sys.platform != "win32":
-                    os.killpg(os.getpgrp(), signal.SIGKILL)
-                else:
-                    for child in active_children():
-                        child.kill()  # Forcefully kill the running worker processes
-                    os._exit(1)
+    workerstats = Counter()
+    jsonlFile = open(args.jsonlFile, "w") if args.jsonlFile else None
+    report = Report(args, finder, maxbm, tb, jsonlFile)
+    anas, reports, sprt = [ana], [report], None
+    if args.engine2:
+        ana2 = copy.copy(ana)
+        ana2.engine, ana2.variant = args.engine2, 1
+        anas.append(ana2)
+        reports.append(Report(args, finder, maxbm, tb, verbose=False))
+        sprt = SPRT(args.sprtAlpha, args.sprtBeta, args.sprtDelta)
+    for i, opts in enumerate(args.engineOptsGrid or []):
+        if i:
+            anas.append(copy.copy(ana))
+            reports.append(Report(args, finder, maxbm, tb, verbose=False))
+        anas[i].engineOpts = {**(args.engineOpts or {}), **opts}
+        anas[i].variant = i
 
-    print("")
+    plan = None
+    if args.memoryBudget is not None:
+        # each worker runs one engine per distinct engine command
+        engines = [
+            next(a for a in anas if a.engine == e).engine_memory()
+            for e in dict.fromkeys(a.engine for a in anas)
+        ]
+        per_engine = sum(mem + hash for mem, hash in engines)
+        python = rss() if args.driver == "pool" else 0  # a forked worker
+        main = rss()
+        safe = int((args.memoryBudget - main) // (per_engine + python))
+        parts = [f"engine {round(m)}, hash {h}" for m, h in engines]
+        parts += [f"Python {round(python)}"] if python else []
+        plan = (
+            f"{min(workers, safe)} engine worker(s) x {round(per_engine + python)} MB ({', '.join(parts)})"
+            + f" + {round(main)} MB main process, within the budget of {round(args.memoryBudget)} MB"
+        )
+        if safe < 1:
+            sys.exit(
+                f"Cannot start a single engine worker within the memory budget of {round(args.memoryBudget)} MB,"
+                + f" as each needs about {round(per_engine + python)} MB and the main process uses {round(main)} MB."
+                + " Use a smaller --hash or raise --memoryBudget."
+            )
+        if safe < workers:
+            print(
+                f"Reduced the engine workers from {workers} to {safe} to fit the memory budget."
+            )
+            workers = safe
+        print("Memory plan:", plan)
+    # reports for the smaller budgets of --nodesCurve, derived from each result
+    curve = {
+        b: Report(args, finder, maxbm, tb, verbose=False) for b in args.nodesCurve[:-1]
+    }
 
-    tb = None
-    if args.syzygyPath is not None:
-        tb = TB(args.syzygyPath, args.syzygy50MoveRule)
-        c = 0
-        for _, _, pvstatus, _, _, _, _ in res:
-            c += sum(1 for (multipv, _, score, _) in pvstatus if score is not None)
-        if c:
-            print(f"Checking up to {c} TB win PVs. This may take some time ...")
-
-    mates = bestmates = tbwins = 0
-    issue = {}
-    for txt in [
-        "Invalid mate scores",
-        "Better mates",
-        "Wrong mates",
-        "Unexpected mates",
-        "Bad PVs",
-        "Wrong TB scores",
-        "Unexpected TB scores",
-    ]:
-        for prefix in ["", "MultiPV "]:
-            issue[prefix + txt] = [0, 0]
-    bestnodes = [[] for _ in range(maxbm + 1)]
-    bestdepth = [[] for _ in range(maxbm + 1)]
-    foundmates = {}
-    missedmates = set()
-    for fen, bestmate, pvstatus, nodes, depth, _, _ in res:
-        found_mate = None
-        found_issues = set()
+    def add_result(result):
+        report.add(result)
+        if result[2] is None:  # crashed, for every nodes limit
+            for r in curve.values():
+                r.add(result)
+        for budget, r in result[8]:
+            curve[budget].add(r)
 
-        def record_issue(multipv, key, txt, fen, bm, pv=None):
-            if multipv != 1:
-                key = "MultiPV " + key
-                txt = f"multipv{multipv}: " + txt
-            issue[key][0] += 1
-            first_time = key not in found_issues
-            if first_time or args.showAllIssues:
-                issue[key][1] += int(first_time)
-                found_issues.add(key)
-                txt += (
-                    f' for FEN "{fen}" '
-                    + (f" with bm #{bm}." if bm else " without bm.")
-                    + (f"\nPV: {' '.join(pv)}" if pv else "")
-                )
-                print(txt)
+    journal = None
+    if args.journalFile:
+        journal = Journal(args.journalFile, run_config(args, ana, name), args.resume)
+        # only the journalled positions that are part of this run's suite
+        resumed = [journal.results[k] for k in fens if k in journal.results]
+        if args.resume:
+            print(f"Resuming with {len(resumed)} results from {args.journalFile}.")
+        for result in resumed:
+            add_result(result)
+        fens = [fen_bm for fen_bm in fens if fen_bm not in journal.results]
 
-        for (multipv, mate, score, pv), (status, last_line) in pvstatus.items():
-            if mate and (mate > args.maxValidMate or mate < args.minValidMate):
-                txt = f"Found invalid mate #{mate} outside of [{args.minValidMate}, {args.maxValidMate}]"
-                record_issue(multipv, "Invalid mate scores", txt, fen, bestmate)
-            if pv == "bound":
-                continue
-            if mate:
-                if bestmate:
-                    if mate * bestmate > 0:
-                        if last_line:  #  for mate counts use last valid UCI info output
-                            mates += 1
-                            foundmates[fen] = mate
-                            if mate == bestmate:
-                                bestmates += 1
-                                bestnodes[abs(mate)].append(nodes)
-                                bestdepth[abs(mate)].append(depth)
-                            found_mate = mate
-                        if abs(mate) < abs(bestmate) and (multipv == 1 or mate > 0):
-                            txt = f"Found mate #{mate} (better)"
-                            record_issue(multipv, "Better mates", txt, fen, bestmate)
-                        if status != "ok":
-                            txt = f'Found mate #{mate} with PV status "{status}"'
-                            record_issue(multipv, "Bad PVs", txt, fen, bestmate, pv)
-                    elif multipv == 1 or mate > 0:
-                        txt = f"Found mate #{mate} (wrong sign)"
-                        record_issue(multipv, "Wrong mates", txt, fen, bestmate)
-                elif mate:
-                    txt = f"Found mate #{mate} (unexpected)"
-                    record_issue(multipv, "Unexpected mates", txt, fen, bestmate)
-            elif tb is not None:
-                if bestmate:
-                    if score * bestmate > 0:
-                        if last_line:
-                            tbwins += 1
-                        status = pv_status(fen, mate, score, pv, tb, args.maxTBscore)
-                        if (
-                            (status != "ok" and not args.shortTBPVonly)
-                            or status == "short"
-                            or "TB entry" in status
-                        ):
-                            txt = f'Found TB score {score} with PV status "{status}"'
-                            record_issue(multipv, "Bad PVs", txt, fen, bestmate, pv)
-                    elif multipv == 1 or score > 0:
-                        txt = f"Found TB score {score} (wrong sign)"
-                        record_issue(multipv, "Wrong TB scores", txt, fen, bestmate)
-                else:
-                    txt = f"Found TB score {score} (unexpected)"
-                    record_issue(multipv, "Unexpected TB scores", txt, fen, bestmate)
+    cache = None
+    if args.cacheFile:
+        if (args.threads or 1) > 1 or args.time is not None:
+            print("Result cache disabled for non-deterministic --threads or --time.")
+        else:
+            cache = ResultCache(args.cacheFile, run_config(args, ana, name))
+            cached = cache.get(fens)
+            for result in cached.values():
+                add_result(result)
+            if journal is not None:
+                journal.put(cached.values())
+            fens = [fen_bm for fen_bm in fens if fen_bm not in cached]
+            print(f"Found {len(cached)} results in {args.cacheFile}.")
 
-        if found_mate is None:
-            missedmates.add(fen)
+    fensbatched = list(batches(fens, workers, estimate_cost))
+    if ana.suite is not None:
+        fensbatched = [[indices[fen] for fen, _ in batch] for batch in fensbatched]
+    if recording is not None:
+        fensbatched = [
+            [(fen, bm, recording[fen]) for fen, bm in batch] for batch in fensbatched
+        ]
+    # the engines to compare search the same batches one after the other
+    fensbatched = [(v, batch) for batch in fensbatched for v in range(len(anas))]
 
-        if args.mate == 0:
-            if found_mate is None:
-                print(f'Did not find mate for FEN "{fen}" with bm #{bestmate}.')
-            elif found_mate != bestmate:
-                print(
-                    f'Only found mate #{found_mate} for FEN "{fen}" with bm #{bestmate}.'
-                )
+    def collect(future, stats, variant=0, trace=None, records=None):
+        if records:
+            recorder.write(records)
+        if trace is not None:  # from a worker process
+            totals, events, pid, end = trace
+            profiler.totals.update(totals)
+            if events:
+                profiler.events += events
+            profiler.add("transfer", end, time() - end, pid=pid)
+        with span("report"):
+            add_batch(future, stats, variant)
 
-        if not multipv_fens:
-            continue
+    def add_batch(future, stats, variant):
+        pbar.update(len(future))
+        searched[variant] += len(future)
+        workerstats.update(stats)
+        if sprt is not None:
+            for result in future:
+                sprt.add(result[0], variant, best_mate_found(result))
+        if variant:
+            for result in future:
+                reports[variant].add(result)
+            return
+        for result in future:
+            add_result(result)
+        # crashed positions are searched again in later runs
+        future = [r for r in future if r[2] is not None]
+        if journal is not None:
+            journal.put(future)
+        if cache is not None:
+            cache.put(future)
 
-        # check mate and TB scores in MultiPV lines for correctness
-        for (multipv, mate, score, pv), (status, last_line) in pvstatus.items():
-            if not (mate or tb) or not pv or pv == "bound":
-                continue
-            board = chess.Board(fen)
-            move = pv[0]
-            uci = chess.Move.from_uci(move)
-            if uci not in board.legal_moves:
-                txt = f"Found illegal root move {move}"
-                record_issue(multipv, "Bad PVs", txt, fen, bestmate, pv)
-                continue
-            board.push(uci)
-            child = board.epd()
-            if child not in multipv_fens:
-                continue
-            childbm = multipv_fens[child]
-            if childbm:  # adjust to root PoV
-                childbm = -childbm + (1 if childbm < 0 else 0)
-            if mate:
-                if childbm:
-                    if mate * childbm > 0:
-                        if abs(mate) < abs(childbm):
-                            txt = f"Found mate #{mate} (better than #{childbm}) for move {move}"
-                            record_issue(multipv, "Better mates", txt, fen, bestmate)
-                        if status != "ok":
-                            txt = f'Found mate #{mate} for move {move} with PV status "{status}"'
-                            record_issue(multipv, "Bad PVs", txt, fen, bestmate, pv)
-                    else:
-                        txt = f"Found mate #{mate} (wrong sign wrt #{childbm}) for move {move}"
-                        record_issue(multipv, "Wrong mates", txt, fen, bestmate)
-                else:
-                    txt = f"Found mate #{mate} (unexpected) for move {move}"
-                    record_issue(multipv, "Unexpected mates", txt, fen, bestmate)
-            elif tb is not None:
-                if childbm:
-                    if score * childbm > 0:
-                        status = pv_status(fen, mate, score, pv, tb, args.maxTBscore)
-                        if (
-                            (status != "ok" and not args.shortTBPVonly)
-                            or status == "short"
-                            or "TB entry" in status
-                        ):
-                            txt = f'Found TB score {score} (for #{childbm}) with PV status "{status}" for move {move}'
-                            record_issue(multipv, "Bad PVs", txt, fen, bestmate, pv)
+    searched = Counter()  # positions completed per variant
+    stopped = False  # the SPRT was decided before all positions were searched
+    workers = max(1, min(workers, len(fensbatched)))
+    cpus = pin_workers(args, workers)
+    if args.serve and args.authKey is None:
+        # the workers exchange pickles with the coordinator, so never use a known key
+        args.authKey = secrets.token_hex(16)
+        print(f"Workers need to connect with --authKey {args.authKey}", flush=True)
+    with tqdm(total=len(fens) * len(anas), smoothing=0, miniters=1) as pbar:
+        if args.serve:
+            try:
+                address = parse_address(args.serve)
+                serve(anas, fensbatched, address, args.authKey.encode(), collect)
+            except chess.engine.EngineTerminatedError as ex:
+                abort(ex)
+        elif args.driver == "async" and recording is None:
+            try:
+                asyncio.run(ana.analyze_fens_async(fens, workers, collect))
+            except chess.engine.EngineTerminatedError as ex:
+                abort(ex)
+        else:
+            with Pool(
+                processes=workers, initializer=init_worker, initargs=(anas, cpus)
+            ) as e:
+                try:
+                    for result in e.imap_unordered(analyze_batch, fensbatched):
+                        collect(*result)
+                        if sprt is not None and sprt.result is not None:
+                            e.terminate()  # the comparison is decided
+                            stopped = sum(searched.values()) < pbar.total
+                            break
                     else:
-                        txt = f"Found TB score {score} (wrong sign wrt #{childbm}) for move {move}"
-                        record_issue(multipv, "Wrong TB scores", txt, fen, bestmate)
-                else:
-                    txt = f"Found TB score {score} (unexpected) for move {move}"
-                    record_issue(multipv, "Unexpected TB scores", txt, fen, bestmate)
+                        e.close()
+                        e.join()  # let the workers quit their engines
+                except chess.engine.EngineTerminatedError as ex:
+                    e.terminate()
+                    abort(ex)
+
+    print("")
+    if cache is not None:
+        cache.close()
+    if journal is not None:
+        journal.close()
+    if recorder is not None:
+        recorder.close()
+    if jsonlFile is not None:
+        jsonlFile.close()
+
+    if args.profileTrace:
+        with open(args.profileTrace, "w") as f:
+            json.dump({"traceEvents": profiler.events, "displayTimeUnit": "ms"}, f)
 
     print(f"\nUsing {msg}")
+    if plan is not None:
+        print("Memory plan:  ", plan)
     if name:
         print("Engine ID:    ", name)
     print("Total FENs:   ", numfen)
+    if stopped:
+        print(
+            f"Searched FENs: {searched[0]} by A and {searched[1]} by B, as the run stopped early once the SPRT was decided,"
+            + " so all results below and in the output files are partial"
+        )
     if numfen != numbm:
         print("FENs w/ bm:   ", numbm)
-    print("Found mates:  ", mates)
-    print("Best mates:   ", bestmates)
-    if tbwins:
-        print("Found TB wins:", tbwins)
+    print("Found mates:  ", report.mates)
+    print("Best mates:   ", report.bestmates)
+    if report.tbwins:
+        print("Found TB wins:", report.tbwins)
 
-    if (args.showAllStats or args.mate is not None) and bestmates:
+    if strata is not None:
+        outcomes = {k: ([], []) for k in strata}
+        for fen, bm in sample:
+            found, best = outcomes[stratum(fen, bm, args.sampleByPieces)]
+            mate = report.foundmates.get(fen)
+            found.append(mate is not None)
+            best.append(mate is not None and mate == bm)
+        print(f"\nEstimates for all {len(bmfens)} FENs, with 95% confidence intervals:")
+        for i, label in enumerate(["Found mates: ", "Best mates:  "]):
+            est, lower, upper = stratified_estimate(
+                strata, {k: v[i] for k, v in outcomes.items()}
+            )
+            print(f"{label} {round(est)} [{round(lower)}, {round(upper)}]")
+
+    bestnodes, bestdepth, issue = report.bestnodes, report.bestdepth, report.issue
+    if (args.showAllStats or args.mate is not None) and report.bestmates:
         print("\nBest mate statistics:")
         for bm in range(1, maxbm + 1):
             if bestnodes[bm]:
@@ -699,17 +2661,100 @@ if __name__ == "__main__":
                     f"{key}:{' ' * (28 - len(key))}{value[0]}   (from {value[1]} FENs)"
                 )
 
+    if args.engineOptsGrid:
+        print(
+            "\nComparison of the engine option sets (the results above are for set 0):"
+        )
+        print(
+            f"{'Set':>4}{'Found mates':>14}{'Best mates':>14}{'Nodes':>14}{'Issues':>10}  Options"
+        )
+        for i, r in enumerate(reports):
+            issues = sum(v[0] for v in r.issue.values())
+            opts = json.dumps(args.engineOptsGrid[i])
+            print(
+                f"{i:>4}{r.mates:>14}{r.bestmates:>14}{r.totalnodes:>14}{issues:>10}  {opts}"
+            )
+
+    if sprt is not None:
+        print(f"\nComparison of A = {args.engine} and B = {args.engine2}:")
+        print(f"{'':14}{'A':>8}{'B':>8}")
+        for label, key in [("Found mates:", "mates"), ("Best mates:", "bestmates")]:
+            a, b = (getattr(r, key) for r in reports)
+            print(f"{label:14}{a:>8}{b:>8}")
+        print(
+            f"Best mates in {sprt.pairs} paired positions found by both: {sprt.both}, by A only: {sprt.a}, by B only: {sprt.b}, by neither: {sprt.neither}"
+        )
+        b_better, a_better = sprt.llr()
+        print(
+            f"SPRT (alpha {args.sprtAlpha}, beta {args.sprtBeta}, delta {args.sprtDelta}): LLR(B better) {b_better:.2f}, LLR(A better) {a_better:.2f}, bounds [{sprt.lower:.2f}, {sprt.upper:.2f}]"
+        )
+        print("Result:", sprt.result or "undecided")
+
+    if args.nodesCurve:
+        # an interrupted iteration may end a search with a final info line that
+        # the larger search never sends, so derived results are only approximate
+        print(
+            "\nResults for smaller nodes limits, derived from the UCI output of this run:"
+        )
+        print(f"{'Nodes':>12}{'Found mates':>14}{'Best mates':>14}{'Issues':>10}")
+        curve[args.nodesCurve[-1]] = report
+        for b in args.nodesCurve:
+            r = curve[b]
+            issues = sum(v[0] for v in r.issue.values())
+            txt = f"{b:>12}{r.mates:>14}{r.bestmates:>14}{issues:>10}"
+            print(txt + ("" if r is report else "  (approximate)"))
+
     if args.bench:
-        totalnodes = totaltime = 0
-        for _, _, _, _, _, lastnodes, lasttime in res:
-            totalnodes += lastnodes
-            totaltime += lasttime
+        totalnodes, totaltime = report.totalnodes, report.totaltime
         print("\n===========================")
         print("Total time (ms) :", round(totaltime * 1000))
         print("Nodes searched  :", totalnodes)
         if totaltime > 0:
             print("Nodes/second    :", round(totalnodes / totaltime))
+        probes = workerstats["TB cache hits"] + workerstats["TB cache misses"]
+        if probes:
+            print("TB probes       :", probes)
+            print(
+                "TB cache hits   :",
+                workerstats["TB cache hits"],
+                f"({(workerstats['TB cache hits'] * 1000 // probes) / 10}%)",
+            )
+        lines = workerstats["Info lines"]
+        nps = [
+            workerstats["Worker nodes", key[1]] / t
+            for key, t in workerstats.items()
+            if isinstance(key, tuple) and key[0] == "Worker time" and t > 0
+        ]
+        if len(nps) > 1:
+            mean = sum(nps) / len(nps)
+            sd = math.sqrt(sum((x - mean) ** 2 for x in nps) / (len(nps) - 1))
+            print(
+                "Worker nps      :",
+                f"{round(mean)} +- {round(sd)} ({round(100 * sd / mean, 1)}%), min {round(min(nps))}, max {round(max(nps))}, {len(nps)} workers",
+            )
+        print("UCI info lines  :", lines)
+        if lines:
+            # CPU time spent on the Python side: UCI parsing, PV checks etc.
+            print(
+                "CPU us/line     :",
+                round(workerstats["CPU time"] * 1e6 / lines, 1),
+                (
+                    "(replay)"
+                    if args.replay
+                    else "(raw UCI)" if args.rawUci else "(python-chess)"
+                ),
+            )
+        totals = profiler.totals
+        # the rest of a position's time is spent waiting for the engine
+        totals["engine search"] = (
+            totals["position"] - totals["UCI info handling"] - totals["result"]
+        )
+        print("Phase times (s) : summed over all processes")
+        for phase, level in PHASES:
+            if totals[phase] or phase in ["position", "engine search"]:
+                print(f"{'  ' * level}  {phase:<{20 - 2 * level}}: {totals[phase]:.3f}")
 
+    foundmates, missedmates = report.foundmates, report.missedmates
     if args.foundMatesFile:
         with open(args.foundMatesFile, "w") as f:
             for fen, bm in bmfens.items():
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""A deterministic stand-in UCI engine, to measure the overhead of matecheck.py
+without the variance of a real engine. For each position it replays the info
+lines recorded from a real engine, or synthesizes a stream of info lines that
+only depends on the position, the go command and the options."""
+
+import argparse, chess, json, random, sys
+
+OPTIONS = {
+    # name -> (type, default, min, max)
+    "Hash": ("spin", 16, 1, 33554432),
+    "Threads": ("spin", 1, 1, 1024),
+    "MultiPV": ("spin", 1, 1, 256),
+    "Lines": ("spin", 20, 1, 10000),
+    "PVLength": ("spin", 12, 1, 1000),
+    "MateLines": ("spin", 20, 0, 100),
+    "TBLines": ("spin", 0, 0, 100),
+    "BoundLines": ("spin", 10, 0, 100),
+    "CrashRate": ("spin", 0, 0, 1000),
+    "Seed": ("spin", 0, 0, 2**31 - 1),
+    "Replay": ("string", "", None, None),
+    "SyzygyPath": ("string", "", None, None),
+    "EvalFile": ("string", "", None, None),
+    "Syzygy50MoveRule": ("check", True, None, None),
+    "Ponder": ("check", False, None, None),
+    "UCI_AnalyseMode": ("check", False, None, None),
+}
+
+
+def random_pv(board, rng, length):
+    """Return a random walk of at most length legal moves from board."""
+    board, pv = board.copy(stack=False), []
+    while len(pv) < length and not board.is_game_over():
+        move = rng.choice(list(board.legal_moves))
+        board.push(move)
+        pv.append(move)
+    return pv
+
+
+def synthetic_lines(board, options, nodes=None, depth=None, mate=None):
+    """Yield the info lines of a search of board, and None for a crash. A mate
+    in one is found from depth 2 on, all other scores and PVs are random."""
+    rng = random.Random(f"{options['Seed']} {board.epd()}")
+    moves = list(board.legal_moves)
+    if not moves:
+        yield f"info depth 0 score {'mate' if board.is_checkmate() else 'cp'} 0"
+        return
+    lines = options["Lines"] if depth is None else min(options["Lines"], depth)
+    crash = rng.randrange(1000) < options["CrashRate"]
+    mating = []
+    for move in moves:
+        board.push(move)
+        if board.is_checkmate():
+            mating.append(move)
+        board.pop()
+    rest = [m for m in moves if m not in mating]
+    first = mating + rng.sample(rest, len(rest))
+    pvs = []
+    for move in first[: options["MultiPV"]]:
+        board.push(move)
+        pvs.append([move] + random_pv(board, rng, options["PVLength"] - 1))
+        board.pop()
+    for d in range(1, lines + 1):
+        if crash and d > lines // 2:
+            yield None
+            return
+        n = (nodes * d // lines) if nodes else 1000 * d * d
+        for multipv, pv in enumerate(pvs, 1):
+            pv = pv[: d + 1]
+            bound = ""
+            if pv[0] in mating and d >= 2:
+                score = "mate 1"
+                pv = pv[:1]
+            elif rng.randrange(100) < options["MateLines"]:
+                score = f"mate {rng.choice([1, -1]) * ((len(pv) + 1) // 2)}"
+            elif rng.randrange(100) < options["TBLines"]:
+                score = f"cp {rng.choice([1, -1]) * (20000 - len(pv))}"
+            else:
+                score = f"cp {rng.randint(-300, 300)}"
+            if rng.randrange(100) < options["BoundLines"]:
+                bound = rng.choice([" lowerbound", " upperbound"])
+            yield (
+                f"info depth {d} seldepth {d + 2} multipv {multipv} score {score}{bound}"
+                + f" nodes {n} nps 1000000 hashfull 0 tbhits 0 time {max(1, n // 1000)}"
+                + f" pv {' '.join(m.uci() for m in pv)}"
+            )
+        if mate and mating and d >= 2:
+            return  # the mate in one satisfies any go mate
+
+
+def load_replay(filename):
+    """Return a dict from the EPD of a position to its recorded info lines."""
+    replay = {}
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                replay[chess.Board(record["fen"]).epd()] = record["lines"]
+    return replay
+
+
+def replayed_lines(lines, nodes=None):
+    for line in lines:
+        tokens = line.split()
+        if nodes and "nodes" in tokens[:-1]:
+            if int(tokens[tokens.index("nodes") + 1]) > nodes:
+                return
+        yield line if line.startswith("info") else "info " + line
+
+
+def parse_go(tokens):
+    limits = {}
+    for key in ["nodes", "depth", "mate"]:
+        if key in tokens[:-1]:
+            limits[key] = int(tokens[tokens.index(key) + 1])
+    return limits
+
+
+def uci_loop():
+    options = {name: opt[1] for name, opt in OPTIONS.items()}
+    board, replay = chess.Board(), {}
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] == "uci":
+            print("id name MockEngine")
+            print("id author the matetrack developers")
+            for name, (kind, default, lo, hi) in OPTIONS.items():
+                default = str(default).lower() if kind == "check" else default
+                txt = f"option name {name} type {kind} default {default}"
+                print(txt + (f" min {lo} max {hi}" if kind == "spin" else ""))
+            print("uciok", flush=True)
+        elif tokens[0] == "isready":
+            print("readyok", flush=True)
+        elif tokens[0] == "setoption" and "name" in tokens:
+            i = tokens.index("name") + 1
+            j = tokens.index("value") if "value" in tokens else len(tokens)
+            name, value = " ".join(tokens[i:j]), " ".join(tokens[j + 1 :])
+            name = next((n for n in OPTIONS if n.lower() == name.lower()), name)
+            if name in OPTIONS:
+                kind = OPTIONS[name][0]
+                if kind == "spin":
+                    value = int(value)
+                elif kind == "check":
+                    value = value.lower() == "true"
+                options[name] = value
+                if name == "Replay":
+                    replay = load_replay(value) if value else {}
+        elif tokens[0] == "position":
+            if tokens[1] == "startpos":
+                board = chess.Board()
+            else:
+                end = tokens.index("moves") if "moves" in tokens else len(tokens)
+                board = chess.Board(" ".join(tokens[2:end]))
+            if "moves" in tokens:
+                for move in tokens[tokens.index("moves") + 1 :]:
+                    board.push_uci(move)
+        elif tokens[0] == "go":
+            limits = parse_go(tokens)
+            epd = board.epd()
+            if epd in replay:
+                infos = replayed_lines(replay[epd], limits.get("nodes"))
+            else:
+                infos = synthetic_lines(board, options, **limits)
+            best = None
+            for info in infos:
+                if info is None:
+                    sys.exit(1)  # a crash, without bestmove
+                print(info)
+                if " pv " in info and " multipv " not in info or " multipv 1 " in info:
+                    best = info.split(" pv ")[1].split()[0]
+            sys.stdout.flush()
+            print(f"bestmove {best or '(none)'}", flush=True)
+        elif tokens[0] == "quit":
+            break
+
+
+def record(args):
+    """Store the info lines of a real engine for each position of the suite."""
+    import chess.engine
+    from matecheck import RawUciEngine, load_bmfens
+
+    engine = RawUciEngine(args.engine)
+    if args.engineOpts:
+        engine.configure(json.loads(args.engineOpts))
+    limit = chess.engine.Limit(nodes=args.nodes)
+    with open(args.outFile, "w") as f:
+        for fen in load_bmfens(args.epdFile):
+            board = chess.Board(fen)
+            lines = [line.strip() for line in engine.analysis(board, limit)]
+            f.write(json.dumps({"fen": fen, "lines": lines}) + "\n")
+    engine.quit()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["record"]:
+        uci_loop()
+        sys.exit(0)
+    parser = argparse.ArgumentParser(
+        prog="mockengine.py record",
+        description="Record the info lines of a real engine, to be replayed by this mock engine with its Replay option.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--engine", default="./stockfish", help="name of the engine binary"
+    )
+    parser.add_argument(
+        "--epdFile",
+        nargs="+",
+        default=["matetrack.epd"],
+        help="file(s) containing the positions and their mate scores",
+    )
+    parser.add_argument(
+        "--nodes", type=int, default=100000, help="nodes limit per position"
+    )
+    parser.add_argument(
+        "--engineOpts",
+        help="json encoded dictionary of generic options to initialize the engine",
+    )
+    parser.add_argument(
+        "--outFile",
+        default="replay.jsonl",
+        help="output file with one json record of a FEN and its info lines per line",
+    )
+    record(parser.parse_args(sys.argv[2:]))